@@ -4,23 +4,19 @@ import os
 # Configuration (MUST be the first Streamlit function call)
 st.set_page_config(page_title="Kassalapp Assistant", page_icon="🛒", layout="wide", initial_sidebar_state="expanded")
 
-import json
 from dotenv import load_dotenv
-from groq import Groq
-from tools import (
-    search_products,
-    get_product_by_id,
-    get_product_by_ean,
-    search_physical_stores,
-    find_physical_store_by_id,
-    compare_product_prices_by_url,
-    format_product_list
-)
-from rag_engine import KassalappRAG
+# Heavy modules (groq, pinecone, sentence_transformers) are imported lazily or by the
+# background warm-up in startup.py, so nothing here delays the first frame
+from startup import start_warmup, get_rag, get_timings, warmup_status, mark_first_frame
+from chat_pipeline import execute_tool, answer_prompt
+from rate_limit import get_metrics
 
 # Load environment variables
 load_dotenv(override=True)
 
+# Load the embedding model and connect to Pinecone in the background (shared by all sessions)
+start_warmup()
+
 # --- CUSTOM CSS (Glassmorphism & Premium UI) ---
 st.markdown("""
 <style>
@@ -98,107 +94,23 @@ if "messages" not in st.session_state:
 # Constants
 DEFAULT_MODEL = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
 
-# Initialize RAG Engine
-if "rag" not in st.session_state:
-    with st.spinner("Connecting to Knowledge Base..."):
-        st.session_state.rag = KassalappRAG()
-
-# Initialize Groq Client
-if "client" not in st.session_state:
-    # Universal Secrets: Try Streamlit Secrets (Cloud), then Environment Variables (Local)
-    try:
-        api_key = st.secrets.get("GROQ_API_KEY") or os.getenv("GROQ_API_KEY")
-    except Exception:
-        api_key = os.getenv("GROQ_API_KEY")
-        
-    if not api_key:
-        st.error("GROQ_API_KEY not found. Please set it as a Secret or Environment Variable.")
-        st.stop()
-    st.session_state.client = Groq(api_key=api_key)
-
-rag = st.session_state.rag
-client = st.session_state.client
+# Groq API Key
+# Universal Secrets: Try Streamlit Secrets (Cloud), then Environment Variables (Local)
+try:
+    GROQ_API_KEY = st.secrets.get("GROQ_API_KEY") or os.getenv("GROQ_API_KEY")
+except Exception:
+    GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
-# Define Tools for Groq (Aligned with OpenAPI Spec)
-tools = [
-     {
-        "type": "function",
-        "function": {
-            "name": "search_products",
-            "description": "Search for groceries and products to find the price and store. Use the 'store' parameter to filter by a specific store (KIWI, REMA_1000, MENY_NO, SPAR_NO, etc.).",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "search": {"type": "string", "description": "The product name (min 3 chars)."},
-                    "store": {"type": "string", "description": "Store filter: KIWI, REMA_1000, MENY_NO, SPAR_NO, etc."}
-                },
-                "required": ["search"]
-            }
-        }
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "search_physical_stores",
-            "description": "Find grocery stores by location, name, or chain (group).",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "search": {"type": "string", "description": "City or location name."},
-                    "group": {"type": "string", "description": "Chain name (e.g. KIWI, REMA_1000, COOP_NO, MENY_NO)."}
-                }
-            }
-        }
-    }
-]
+if not GROQ_API_KEY:
+    st.error("GROQ_API_KEY not found. Please set it as a Secret or Environment Variable.")
+    st.stop()
 
-# Helper to execute tools
-def execute_tool(name, args):
-    if name == "search_products":
-        # Type coercion: Convert string numbers to integers
-        if "size" in args and isinstance(args["size"], str):
-            try:
-                args["size"] = int(args["size"])
-            except (ValueError, TypeError):
-                args["size"] = 10  # Default fallback
-        
-        # Normalize store codes to match Kassalapp API expectations
-        if "store" in args and args["store"]:
-            # Comprehensive store mapping for major Norwegian chains
-            STORE_MAPPING = {
-                # Major chains
-                "KIWI": "KIWI",
-                "REMA": "REMA_1000",
-                "REMA 1000": "REMA_1000",
-                "MENY": "MENY_NO",
-                "SPAR": "SPAR_NO",
-                "BUNNPRIS": "BUNNPRIS",
-                "JOKER": "JOKER_NO",
-                
-                # Coop variants
-                "COOP": "COOP_NO",
-                "COOP MEGA": "COOP_MEGA",
-                "COOP EXTRA": "COOP_EXTRA",
-                "COOP OBS": "COOP_OBS",
-                "COOP PRIX": "COOP_PRIX",
-                "COOP MARKED": "COOP_MARKED",
-                
-                # Online
-                "ODA": "ODA_NO",
-            }
-            
-            store_input = args["store"].upper().strip()
-            args["store"] = STORE_MAPPING.get(store_input, store_input)
-        return search_products(**args)
-    elif name == "search_physical_stores":
-        # Type coercion for size parameter
-        if "size" in args and isinstance(args["size"], str):
-            try:
-                args["size"] = int(args["size"])
-            except (ValueError, TypeError):
-                args["size"] = 20  # Default fallback
-        return search_physical_stores(**args)
-    return {"error": "Tool not found"}
+def get_client():
+    """Creates the Groq client on first use, by which time the warm-up has imported groq."""
+    if "client" not in st.session_state:
+        from groq import Groq
+        st.session_state.client = Groq(api_key=GROQ_API_KEY)
+    return st.session_state.client
 
 # Main UI
 st.title("🛒 Kassalapp Assistant")
@@ -222,7 +134,11 @@ with st.sidebar:
     st.markdown("---")
     
     # Cloud Status Badge
-    status = "✓ Pinecone Connected" if st.session_state.get('rag') else "✗ Not Connected"
+    status = {
+        "ready": "✓ Pinecone Connected",
+        "warming": "⏳ Connecting...",
+        "failed": "✗ Not Connected",
+    }[warmup_status()]
     st.markdown(f'**System Status**<br><span class="status-badge">{status}</span>', unsafe_allow_html=True)
     st.markdown("---")
     
@@ -259,6 +175,12 @@ with st.sidebar:
     Then restart the app.
     """)
 
+    with st.expander("📊 Rate Limits"):
+        st.json(get_metrics())
+
+    with st.expander("⏱️ Startup Profile"):
+        st.json(get_timings())
+
 # Display Chat History
 for message in st.session_state.messages:
     with st.chat_message(message["role"]):
@@ -282,96 +204,49 @@ if prompt := st.chat_input("Ask about grocery prices, stores, or loyalty program
             message_placeholder.markdown(final_text)
             st.session_state.messages.append({"role": "assistant", "content": final_text})
         else:
-            # 2. RAG Retrieval
-            relevant_docs = rag.query(prompt, n_results=2)
-            context = "\n".join(relevant_docs)
-            
-            system_prompt = f"""You are Kassalapp Assistant, a precise guide to Norwegian groceries.
-            
-            CONTEXT FROM GUIDE:
-            {context}
-            
-            TOOLS:
-            - search_products: Use for specific price or availability questions.
-            - search_physical_stores: Use to find store locations or chains.
-            
-            INSTRUCTIONS:
-            - If the question can be answered by the Context above, answer directly.
-            - If you need real-time data, use the tool calling feature.
-            - If a product query is ambiguous (e.g., "Coca Cola" could mean regular, sugar-free, different sizes), ask the user to clarify BEFORE using tools.
-            - After receiving tool results, always present them to the user in a clear, friendly format.
-            - If tool results show no price data or empty results, inform the user politely.
-            - DO NOT output tool names in tags like <function> or within the text.
-            - Be concise but helpful.
-            """
-            
-            messages = [{"role": "system", "content": system_prompt}]
-            for m in st.session_state.messages:
-                messages.append({"role": m["role"], "content": m["content"]})
-                
+            # 2. Knowledge Base (waits for the background warm-up on a cold start)
             try:
-                # LLM Loop
-                max_turns = 3
-                current_turn = 0
-                final_text = None
-                
-                while current_turn < max_turns:
-                    response = client.chat.completions.create(
-                        model=MODEL_NAME,
-                        messages=messages,
-                        tools=tools,
-                        tool_choice="auto",
-                        temperature=0.1 # Lower temperature for stability
-                    )
-                    
-                    response_message = response.choices[0].message
-                    
-                    # Check if there are tool calls to execute
-                    if not response_message.tool_calls:
-                        # No tool calls - this is the final response
-                        messages.append(response_message)
-                        final_text = response_message.content
-                        if final_text:
-                            message_placeholder.markdown(final_text)
-                            st.session_state.messages.append({"role": "assistant", "content": final_text})
-                        break
-                    
-                    # There are tool calls - add message and execute them
-                    # DO NOT display content here, even if present - wait for final synthesis
-                    messages.append(response_message)
-                    
-                    # Execute tool calls
-                    for tool_call in response_message.tool_calls:
-                        func_name = tool_call.function.name
-                        func_args = json.loads(tool_call.function.arguments)
-                        
-                        with st.status(f"🛠️ Connecting to Kassalapp: `{func_name}`", expanded=True):
-                            st.write(f"Parameters: `{func_args}`")
-                            try:
-                                result = execute_tool(func_name, func_args)
-                                st.write(f"Result: `{result}`")  # DEBUG: Show what we got back
-                            except Exception as e:
-                                result = {"error": str(e)}
-                                st.error(f"Tool execution error: {str(e)}")
-                        
-                        messages.append({
-                            "tool_call_id": tool_call.id,
-                            "role": "tool",
-                            "name": func_name,
-                            "content": json.dumps(result)
-                        })
-                    
-                    current_turn += 1
-                
-                # If we exit the loop without a final response, show an error
-                if final_text is None and current_turn >= max_turns:
-                    error_msg = "I apologize, but I encountered an issue processing the results. Please try your question again."
-                    message_placeholder.markdown(error_msg)
-                    st.session_state.messages.append({"role": "assistant", "content": error_msg})
+                if warmup_status() == "ready":
+                    rag = get_rag()
+                else:
+                    with st.spinner("Connecting to Knowledge Base..."):
+                        rag = get_rag()
+            except Exception as e:
+                st.error(f"Knowledge Base Error: {str(e)}")
+                st.stop()
+
+            # Show every tool call while the pipeline runs it
+            def run_tool_with_status(func_name, func_args):
+                with st.status(f"🛠️ Connecting to Kassalapp: `{func_name}`", expanded=True):
+                    st.write(f"Parameters: `{func_args}`")
+                    try:
+                        result = execute_tool(func_name, func_args)
+                        st.write(f"Result: `{result}`")  # DEBUG: Show what we got back
+                    except Exception as e:
+                        result = {"error": str(e)}
+                        st.error(f"Tool execution error: {str(e)}")
+                return result
+
+            try:
+                # 3. RAG Retrieval and LLM Loop (see chat_pipeline.py)
+                final_text = answer_prompt(
+                    get_client(),
+                    rag,
+                    prompt,
+                    st.session_state.messages,
+                    MODEL_NAME,
+                    tool_runner=run_tool_with_status
+                )
+                if final_text:
+                    message_placeholder.markdown(final_text)
+                    st.session_state.messages.append({"role": "assistant", "content": final_text})
                 
             except Exception as e:
                 st.error(f"API Error: {str(e)}")
 
+# Startup profile: time until the UI was first interactive
+mark_first_frame()
+
 def upload_batch_with_retry(index, batch, max_retries=3):
     """Upload a batch of vectors to Pinecone with exponential backoff retry logic."""
     for attempt in range(max_retries):
@@ -397,4 +272,3 @@ def upload_batch_with_retry(index, batch, max_retries=3):
     if batch:
         print(f"Uploading final batch of {len(batch)} vectors...")
         upload_batch_with_retry(index, batch)
-
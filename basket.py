@@ -0,0 +1,236 @@
+"""
+Shopping Basket Optimizer for Kassalapp Assistant.
+
+Answers "where is my whole list cheapest?" in a single tool call. The shopping list
+is deduplicated and every item is resolved to one product (EAN) with a single search,
+so all chains are compared on the same product. One EAN lookup then returns that
+product's price at every store, which costs two Kassalapp calls per item regardless
+of the number of chains. The lookups run concurrently at background priority behind
+the shared limiter in rate_limit.py, so a basket only uses spare quota and a basket
+that would have to queue too long is refused up front. The prices are collected
+into a NumPy price matrix (items x chains). The cheapest single store, the cheapest
+two-store split and the missing-item coverage are then computed from that matrix in
+one vectorized pass.
+
+Usage:
+    python basket.py melk brød "pepsi max"
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from rate_limit import background, estimate_wait, max_calls
+from tools import search_products, get_product_by_ean
+
+# Chains compared when the caller does not restrict the search
+DEFAULT_CHAINS = [
+    "KIWI",
+    "REMA_1000",
+    "MENY_NO",
+    "SPAR_NO",
+    "JOKER_NO",
+    "BUNNPRIS",
+    "COOP_EXTRA",
+    "COOP_MEGA",
+    "ODA_NO",
+]
+
+MAX_ITEMS = 25           # Hard cap; the quota may allow fewer (see max_items())
+MAX_WORKERS = 8
+CANDIDATES_PER_LOOKUP = 5
+CALLS_PER_ITEM = 2       # One product search and one EAN lookup
+MAX_QUEUE_WAIT = 20      # Seconds a basket may queue for Kassalapp quota before it is refused
+
+
+def max_items():
+    """Largest basket the Kassalapp quota can price within MAX_QUEUE_WAIT on an idle process."""
+    return max(1, min(MAX_ITEMS, max_calls("kassalapp", MAX_QUEUE_WAIT) // CALLS_PER_ITEM))
+
+
+def normalize_items(items):
+    """Strips, lowercases and deduplicates a shopping list while keeping its order."""
+    seen = set()
+    unique = []
+    for item in items or []:
+        if not isinstance(item, str):
+            continue
+        key = " ".join(item.lower().split())
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(key)
+    return unique
+
+
+def _chain_key(store):
+    """Comparable chain key for a store code or name (e.g. "MENY_NO" and "Meny" -> "MENY")."""
+    return "_".join(str(store).upper().split()).removesuffix("_NO")
+
+
+def resolve_product(item):
+    """Resolves a shopping-list item to one product (the best search match with an EAN), or None."""
+    result = search_products(search=item, size=CANDIDATES_PER_LOOKUP, sort=None)
+    for product in result.get("data", []):
+        if product.get("ean"):
+            return {"item": item, "name": product.get("name"), "ean": product["ean"]}
+    return None
+
+
+def lookup_prices(product, chains):
+    """Returns the product's current price at each chain (NaN where it is not sold) from one EAN lookup."""
+    prices = np.full(len(chains), np.nan)
+    if product is None:
+        return prices
+    result = get_product_by_ean(product["ean"])
+    data = result.get("data")
+    if not isinstance(data, dict):
+        return prices
+
+    columns = {_chain_key(chain): c for c, chain in enumerate(chains)}
+    for entry in data.get("products") or []:
+        store = entry.get("store") or {}
+        c = columns.get(_chain_key(store.get("code") or store.get("name") or ""))
+        price = entry.get("current_price")
+        # The EAN endpoint nests the price, product searches return it as a plain number
+        if isinstance(price, dict):
+            price = price.get("price")
+        if c is not None and isinstance(price, (int, float)):
+            prices[c] = np.fmin(prices[c], price)
+    return prices
+
+
+def build_price_matrix(items, chains):
+    """
+    Resolves every item and fetches its prices concurrently.
+
+    Returns (products, prices): the resolved product per item (None if not found) and an
+    items x chains matrix (NaN = not sold there).
+    """
+    def lookup(item):
+        # Background priority: the fan-out only uses spare quota, so other sessions don't queue behind it
+        with background():
+            product = resolve_product(item)
+            return product, lookup_prices(product, chains)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        results = list(executor.map(lookup, items))
+    products = [product for product, _ in results]
+    prices = np.array([row for _, row in results], dtype=np.float64).reshape(len(items), len(chains))
+    return products, prices
+
+
+def _rank(coverage, totals):
+    """Index of the option with the best coverage, breaking ties on the lowest total."""
+    return int(np.lexsort((totals, -coverage))[0])
+
+
+def analyze_prices(prices, items, chains):
+    """
+    Computes the basket summary from a price matrix.
+
+    Args:
+        prices: Array of shape (len(items), len(chains)) with NaN for unavailable items.
+        items: Row labels of the matrix.
+        chains: Column labels of the matrix.
+    """
+    available = ~np.isnan(prices)
+    filled = np.where(available, prices, 0.0)
+    coverage = available.sum(axis=0)
+    totals = filled.sum(axis=0)
+    missing = ~available.any(axis=1)
+    missing_items = [item for item, m in zip(items, missing) if m]
+
+    summary = {
+        "items": list(items),
+        "stores": list(chains),
+        "missing_items": missing_items,
+        "store_totals": [
+            {"store": chains[c], "total": round(float(totals[c]), 2), "items_found": int(coverage[c])}
+            for c in np.lexsort((totals, -coverage))
+        ],
+    }
+    if not available.any():
+        return summary
+
+    # Cheapest single store
+    best = _rank(coverage, totals)
+    summary["cheapest_single_store"] = {
+        "store": chains[best],
+        "total": round(float(totals[best]), 2),
+        "items_found": int(coverage[best]),
+        "items_missing": [item for item, ok in zip(items, available[:, best]) if not ok],
+    }
+
+    # Cheapest two-store split: every pair (a, b) buys each item where it is cheaper
+    if len(chains) > 1:
+        pair_available = available[:, :, None] | available[:, None, :]
+        pair_prices = np.fmin(prices[:, :, None], prices[:, None, :])
+        pair_totals = np.where(pair_available, pair_prices, 0.0).sum(axis=0)
+        pair_coverage = pair_available.sum(axis=0)
+
+        first, second = np.triu_indices(len(chains), k=1)
+        pick = _rank(pair_coverage[first, second], pair_totals[first, second])
+        a, b = int(first[pick]), int(second[pick])
+
+        # Assign each item to the cheaper of the two stores
+        choice = np.where(np.isnan(prices[:, b]) | (prices[:, a] <= prices[:, b]), a, b)
+        assignment = {chains[a]: [], chains[b]: []}
+        for item, c, ok in zip(items, choice, pair_available[:, a, b]):
+            if ok:
+                assignment[chains[c]].append(item)
+
+        # Savings are only meaningful over the items both options can supply
+        common = available[:, best] & pair_available[:, a, b]
+        savings = np.where(common, prices[:, best] - pair_prices[:, a, b], 0.0).sum()
+
+        summary["cheapest_two_store_split"] = {
+            "stores": [chains[a], chains[b]],
+            "total": round(float(pair_totals[a, b]), 2),
+            "items_found": int(pair_coverage[a, b]),
+            "assignment": assignment,
+            "savings_vs_single_store": round(float(savings), 2),
+            "savings_compared_items": int(common.sum()),
+        }
+
+    return summary
+
+
+def optimize_basket(items=None, stores=None, **kwargs):
+    """
+    Finds where a whole shopping list is cheapest.
+
+    Args:
+        items: Product names on the shopping list (e.g. ["melk", "brød"]).
+        stores: Optional store codes to compare (defaults to the major chains).
+    """
+    # Defensive handling for common LLM parameter hallucinations
+    items = normalize_items(items or kwargs.get("products") or kwargs.get("shopping_list"))
+    if not items:
+        return {"error": "Invalid basket", "message": "Provide at least one item."}
+    limit = max_items()
+    if len(items) > limit:
+        return {"error": "Invalid basket", "message": f"A basket can hold at most {limit} items."}
+
+    wait = estimate_wait("kassalapp", len(items) * CALLS_PER_ITEM)
+    if wait > MAX_QUEUE_WAIT:
+        return {
+            "error": "Rate limited",
+            "message": f"The price lookups for {len(items)} items would take about {wait:.0f} seconds at the current API quota. Try fewer items or again shortly."
+        }
+
+    chains = list(dict.fromkeys(stores)) if stores else DEFAULT_CHAINS
+    products, prices = build_price_matrix(items, chains)
+    summary = analyze_prices(prices, items, chains)
+    # Tell the model which product each item was matched to
+    summary["products"] = [
+        product or {"item": item, "name": None, "ean": None} for item, product in zip(items, products)
+    ]
+    return summary
+
+
+if __name__ == "__main__":
+    import json
+
+    shopping_list = sys.argv[1:] or ["melk", "brød", "egg"]
+    start_time = time.time()
+    print(json.dumps(optimize_basket(shopping_list), indent=2, ensure_ascii=False))
+    print(f"Basket optimized in {time.time() - start_time:.2f} seconds.")
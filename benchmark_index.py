@@ -0,0 +1,146 @@
+"""
+Local Vector Index Benchmark for Kassalapp Assistant.
+
+Compares the float16 and binary storage modes of vector_index.py against exact float32
+search: recall@k (overlap with the exact top-k) at several oversample factors, queries
+per second and resident index size.
+
+By default it runs real user-style questions (encoded with the app's embedding model)
+against the embeddings written by sync_to_pinecone.py, which is what the app's recall
+depends on. With --synthetic (or when there is no docstore) it generates a larger
+corpus: topics split into small subtopics with a loose spread, and held-out queries
+drawn from the same distribution rather than perturbed copies of corpus vectors, so
+the nearest neighbours are not trivially separable.
+
+Usage:
+    python benchmark_index.py [--questions FILE] [--k K] [--batch B] [--oversample 1,2,4,8]
+    python benchmark_index.py --synthetic N [--queries Q]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+from vector_index import LocalVectorIndex, MODES, normalize
+
+# Questions of the kind the app answers from the knowledge base (used with --questions unset)
+QUESTIONS = [
+    "What is Trumf and how does it work?",
+    "Hvordan fungerer Trumf bonus?",
+    "Which stores accept Trumf?",
+    "What is Æ in Rema 1000?",
+    "How do I become a Coop member?",
+    "Hva får jeg tilbake som Coop medlem?",
+    "Which grocery chains belong to NorgesGruppen?",
+    "Is Kiwi cheaper than Meny?",
+    "Which chain is the cheapest in Norway?",
+    "Who owns Rema 1000?",
+    "What is Coop Extra?",
+    "Can I order groceries online in Norway?",
+    "Hva er Oda?",
+    "How can I save money on groceries?",
+    "Tips for using Kassal.app",
+    "What are the common Norwegian milk brands?",
+    "Hvilke merker selger Tine?",
+    "What is First Price?",
+    "Are store brands cheaper?",
+    "When are grocery stores open on Sundays?",
+]
+
+DEFAULT_OVERSAMPLE = "1,2,4,8,16,32,64"
+
+
+def synthetic_data(n, n_queries, dim=384, seed=0):
+    """
+    Corpus and held-out queries from the same distribution: n // 1000 topics, each with
+    50 subtopics (about 20 vectors each at n = 50k), plus per-vector noise.
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(max(8, n // 1000), dim))
+    subtopics = rng.normal(size=(len(topics), 50, dim))
+
+    def sample(count):
+        topic = rng.integers(0, len(topics), count)
+        subtopic = rng.integers(0, subtopics.shape[1], count)
+        return normalize(topics[topic] + 0.7 * subtopics[topic, subtopic] + 1.2 * rng.normal(size=(count, dim)))
+
+    return sample(n), sample(n_queries)
+
+
+def encode_questions(questions):
+    """Embeds questions with the app's model (same as rag_engine.py)."""
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError:
+        sys.exit("sentence_transformers is required to encode the benchmark questions (or use --synthetic N).")
+    return normalize(SentenceTransformer("all-MiniLM-L6-v2").encode(questions, batch_size=32))
+
+
+def recall_at_k(found, exact):
+    """Mean fraction of the exact top-k that was found."""
+    k = exact.shape[1]
+    return float(np.mean([len(set(f) & set(e)) / k for f, e in zip(found, exact)]))
+
+
+def run(index, queries, k, batch, oversample=None):
+    """Searches all queries in batches. Returns (indices, queries per second)."""
+    start_time = time.perf_counter()
+    results = [index.search(queries[i:i + batch], k, oversample)[0] for i in range(0, len(queries), batch)]
+    duration = time.perf_counter() - start_time
+    return np.concatenate(results), len(queries) / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, metavar="N", help="Benchmark N synthetic vectors instead of the docstore.")
+    parser.add_argument("--queries", type=int, default=200, help="Number of synthetic queries.")
+    parser.add_argument("--questions", metavar="FILE", help="Questions to encode, one per line (docstore mode).")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=1, help="Queries per search call (1 = interactive use).")
+    parser.add_argument("--oversample", default=DEFAULT_OVERSAMPLE, help="Comma-separated candidates per result to rescore.")
+    args = parser.parse_args()
+    oversamples = [int(o) for o in args.oversample.split(",") if o.strip()]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.synthetic or not LocalVectorIndex.exists():
+            n = args.synthetic or 100_000
+            print(f"Generating {n} synthetic vectors and {args.queries} held-out queries...")
+            corpus, queries = synthetic_data(n, args.queries)
+            # Memory-map the full-precision vectors, exactly like the docstore does
+            path = os.path.join(tmp, "embeddings.npy")
+            np.save(path, corpus)
+            vectors = np.load(path, mmap_mode="r")
+            make_index = lambda mode: LocalVectorIndex(vectors, mode=mode)
+        else:
+            vectors = LocalVectorIndex.from_docstore().vectors
+            make_index = lambda mode: LocalVectorIndex.from_docstore(mode=mode)
+            questions = QUESTIONS
+            if args.questions:
+                with open(args.questions, "r", encoding="utf-8") as f:
+                    questions = [line.strip() for line in f if line.strip()]
+            print(f"Encoding {len(questions)} questions...")
+            queries = encode_questions(questions)
+
+        full_bytes = vectors.nbytes
+        k = min(args.k, len(vectors))
+        print(f"Corpus: {vectors.shape[0]} x {vectors.shape[1]} ({full_bytes / 1e6:.1f} MB as float32), "
+              f"{len(queries)} queries, k={k}, batch={args.batch}\n")
+
+        exact = None
+        print(f"{'mode':<10}{'oversample':>12}{'recall@' + str(k):>12}{'queries/s':>12}{'resident MB':>14}{'smaller':>10}")
+        for mode in MODES:
+            index = make_index(mode)
+            resident = index.resident_bytes or full_bytes
+            # float32 is the exact baseline, oversampling does not apply to it
+            for oversample in [1] if mode == "float32" else oversamples:
+                found, qps = run(index, queries, k, args.batch, oversample)
+                if exact is None:
+                    exact = found
+                print(f"{mode:<10}{oversample:>11}x{recall_at_k(found, exact):>12.3f}{qps:>12.0f}"
+                      f"{resident / 1e6:>14.2f}{full_bytes / resident:>9.0f}x")
+            del index
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Chat Pipeline for Kassalapp Assistant.
+
+The UI-independent part of a chat turn: RAG retrieval, the Groq tool-calling loop and
+tool execution. app.py renders it with Streamlit, and load_test.py drives it headless
+with many concurrent sessions.
+"""
+import json
+from rate_limit import acquire
+from tools import search_products, search_physical_stores
+from price_history import get_price_history
+
+MAX_TURNS = 3
+MAX_TURNS_MESSAGE = "I apologize, but I encountered an issue processing the results. Please try your question again."
+
+# Define Tools for Groq (Aligned with OpenAPI Spec)
+TOOLS = [
+     {
+        "type": "function",
+        "function": {
+            "name": "search_products",
+            "description": "Search for groceries and products to find the price and store. Use the 'store' parameter to filter by a specific store (KIWI, REMA_1000, MENY_NO, SPAR_NO, etc.).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "search": {"type": "string", "description": "The product name (min 3 chars)."},
+                    "store": {"type": "string", "description": "Store filter: KIWI, REMA_1000, MENY_NO, SPAR_NO, etc."}
+                },
+                "required": ["search"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "search_physical_stores",
+            "description": "Find grocery stores by location, name, or chain (group).",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "search": {"type": "string", "description": "City or location name."},
+                    "group": {"type": "string", "description": "Chain name (e.g. KIWI, REMA_1000, COOP_NO, MENY_NO)."}
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "optimize_basket",
+            "description": "Find where a whole shopping list is cheapest. Matches each item to one product (EAN) and compares its price across the major chains in one call. Returns the matched products, the cheapest single store, the cheapest two-store split and any items that could not be found.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "items": {"type": "array", "items": {"type": "string"}, "description": "Product names on the shopping list (e.g. [\"melk\", \"brød\"])."},
+                    "stores": {"type": "array", "items": {"type": "string"}, "description": "Optional store codes to compare (KIWI, REMA_1000, MENY_NO, etc.). Omit to compare all major chains."}
+                },
+                "required": ["items"]
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "get_price_history",
+            "description": "Price trend of a product from locally recorded prices: min/max/median/latest price per store over a time window and recent price drops. Use it for questions like 'has this gotten cheaper?' or 'is it on sale?'. Omit the EAN to list recent price drops across all tracked products.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "ean": {"type": "string", "description": "Product EAN barcode (from search_products results)."},
+                    "days": {"type": "integer", "description": "Time window in days (default 90)."},
+                    "store": {"type": "string", "description": "Optional store name filter (e.g. Kiwi, Meny)."}
+                }
+            }
+        }
+    }
+]
+
+# Comprehensive store mapping for major Norwegian chains
+STORE_MAPPING = {
+    # Major chains
+    "KIWI": "KIWI",
+    "REMA": "REMA_1000",
+    "REMA 1000": "REMA_1000",
+    "MENY": "MENY_NO",
+    "SPAR": "SPAR_NO",
+    "BUNNPRIS": "BUNNPRIS",
+    "JOKER": "JOKER_NO",
+
+    # Coop variants
+    "COOP": "COOP_NO",
+    "COOP MEGA": "COOP_MEGA",
+    "COOP EXTRA": "COOP_EXTRA",
+    "COOP OBS": "COOP_OBS",
+    "COOP PRIX": "COOP_PRIX",
+    "COOP MARKED": "COOP_MARKED",
+
+    # Online
+    "ODA": "ODA_NO",
+}
+
+def normalize_store(store):
+    """Maps a free-text store name to the Kassalapp store code."""
+    store_input = store.upper().strip()
+    return STORE_MAPPING.get(store_input, store_input)
+
+# Helper to execute tools
+def execute_tool(name, args):
+    if name == "search_products":
+        # Type coercion: Convert string numbers to integers
+        if "size" in args and isinstance(args["size"], str):
+            try:
+                args["size"] = int(args["size"])
+            except (ValueError, TypeError):
+                args["size"] = 10  # Default fallback
+        
+        # Normalize store codes to match Kassalapp API expectations
+        if "store" in args and args["store"]:
+            args["store"] = normalize_store(args["store"])
+        return search_products(**args)
+    elif name == "search_physical_stores":
+        # Type coercion for size parameter
+        if "size" in args and isinstance(args["size"], str):
+            try:
+                args["size"] = int(args["size"])
+            except (ValueError, TypeError):
+                args["size"] = 20  # Default fallback
+        return search_physical_stores(**args)
+    elif name == "optimize_basket":
+        from basket import optimize_basket
+
+        # Accept a comma-separated string as well as a list
+        for key in ("items", "stores"):
+            if isinstance(args.get(key), str):
+                args[key] = [part for part in args[key].split(",") if part.strip()]
+        if args.get("stores"):
+            args["stores"] = [normalize_store(s) for s in args["stores"]]
+        return optimize_basket(**args)
+    elif name == "get_price_history":
+        return get_price_history(**args)
+    return {"error": "Tool not found"}
+
+def build_system_prompt(context):
+    """System prompt with the retrieved knowledge base context."""
+    return f"""You are Kassalapp Assistant, a precise guide to Norwegian groceries.
+            
+            CONTEXT FROM GUIDE:
+            {context}
+            
+            TOOLS:
+            - search_products: Use for specific price or availability questions.
+            - search_physical_stores: Use to find store locations or chains.
+            - optimize_basket: Use when the user asks where a list of several products is cheapest. Call it ONCE with the whole list instead of calling search_products per item and store.
+            - get_price_history: Use for price trends, sales or "has it gotten cheaper?" questions. Find the product's EAN with search_products first.
+            
+            INSTRUCTIONS:
+            - If the question can be answered by the Context above, answer directly.
+            - If you need real-time data, use the tool calling feature.
+            - If a product query is ambiguous (e.g., "Coca Cola" could mean regular, sugar-free, different sizes), ask the user to clarify BEFORE using tools.
+            - After receiving tool results, always present them to the user in a clear, friendly format.
+            - If tool results show no price data or empty results, inform the user politely.
+            - DO NOT output tool names in tags like <function> or within the text.
+            - Be concise but helpful.
+            """
+
+def run_tool(name, args):
+    """Executes a tool call, turning exceptions into an error result for the LLM."""
+    try:
+        return execute_tool(name, args)
+    except Exception as e:
+        return {"error": str(e)}
+
+def answer_prompt(client, rag, prompt, history, model, tool_runner=run_tool):
+    """
+    Answers the latest user message.
+
+    Args:
+        client: Groq client (or anything with the same chat.completions.create API).
+        rag: KassalappRAG used to retrieve knowledge base context for the prompt.
+        prompt: The latest user message.
+        history: Chat history as {"role", "content"} dicts, ending with the prompt.
+        model: Groq model name.
+        tool_runner: Callable(name, args) -> result, lets the UI wrap tool execution.
+
+    Returns:
+        The final answer, MAX_TURNS_MESSAGE if the tool loop did not converge, or
+        None if the model returned an empty answer. API errors are raised.
+    """
+    # 1. RAG Retrieval
+    relevant_docs = rag.query(prompt, n_results=2)
+    context = "\n".join(relevant_docs)
+
+    messages = [{"role": "system", "content": build_system_prompt(context)}]
+    for m in history:
+        messages.append({"role": m["role"], "content": m["content"]})
+
+    # 2. LLM Loop
+    for _ in range(MAX_TURNS):
+        acquire("groq")
+        response = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            tools=TOOLS,
+            tool_choice="auto",
+            temperature=0.1 # Lower temperature for stability
+        )
+
+        response_message = response.choices[0].message
+
+        # Check if there are tool calls to execute
+        if not response_message.tool_calls:
+            # No tool calls - this is the final response
+            return response_message.content
+
+        # There are tool calls - add message and execute them
+        messages.append(response_message)
+
+        # Execute tool calls
+        for tool_call in response_message.tool_calls:
+            func_name = tool_call.function.name
+            func_args = json.loads(tool_call.function.arguments)
+            result = tool_runner(func_name, func_args)
+
+            messages.append({
+                "tool_call_id": tool_call.id,
+                "role": "tool",
+                "name": func_name,
+                "content": json.dumps(result)
+            })
+
+    # We exited the loop without a final response
+    return MAX_TURNS_MESSAGE
@@ -0,0 +1,136 @@
+"""
+Local Chunk Docstore for Kassalapp Assistant.
+
+Keeps the knowledge chunk text next to the app instead of inside Pinecone metadata, so
+the vector index only has to store IDs and small filterable fields. The store is three
+files written by sync_to_pinecone.py:
+
+    docstore/chunks.bin      UTF-8 chunk texts, concatenated
+    docstore/chunks.json     Offset table: {chunk_id: [offset, length, source]}
+    docstore/embeddings.npy  Optional. Normalized float32 embeddings, one row per chunk in
+                             table order (searched locally by vector_index.py); only written
+                             when every chunk was added with an embedding
+
+At query time chunks.bin is memory-mapped and texts are sliced straight out of the
+mapping, so nothing is loaded into memory until a chunk is actually requested.
+"""
+import os
+import json
+import mmap
+import numpy as np
+
+DOCSTORE_DIR = os.getenv("DOCSTORE_DIR", "docstore")
+DATA_FILE = "chunks.bin"
+TABLE_FILE = "chunks.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+
+
+def lean_metadata():
+    """True when Pinecone is synced without chunk text (PINECONE_LEAN_METADATA), so the text only lives here."""
+    return os.getenv("PINECONE_LEAN_METADATA", "false").lower() in ("1", "true", "yes")
+
+
+class DocStoreWriter:
+    """Builds a fresh docstore. Files are swapped in atomically on close()."""
+
+    def __init__(self, path=DOCSTORE_DIR):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.data_path = os.path.join(path, DATA_FILE)
+        self.table_path = os.path.join(path, TABLE_FILE)
+        self.embeddings_path = os.path.join(path, EMBEDDINGS_FILE)
+        self.data = open(self.data_path + ".tmp", "wb")
+        self.table = {}
+        self.embeddings = []
+        self.offset = 0
+
+    def add(self, chunk_id, text, source=None, embedding=None):
+        encoded = text.encode("utf-8")
+        self.data.write(encoded)
+        self.table[chunk_id] = [self.offset, len(encoded), source]
+        self.offset += len(encoded)
+        if embedding is not None:
+            self.embeddings.append(embedding)
+
+    def close(self):
+        self.data.close()
+        with open(self.table_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.table, f, ensure_ascii=False)
+
+        # Embeddings are only kept when every chunk has one, so rows always line up with the table
+        write_embeddings = self.embeddings and len(self.embeddings) == len(self.table)
+        if write_embeddings:
+            vectors = np.asarray(self.embeddings, dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            with open(self.embeddings_path + ".tmp", "wb") as f:
+                np.save(f, vectors)
+
+        os.replace(self.data_path + ".tmp", self.data_path)
+        os.replace(self.table_path + ".tmp", self.table_path)
+        if write_embeddings:
+            os.replace(self.embeddings_path + ".tmp", self.embeddings_path)
+        elif os.path.exists(self.embeddings_path):
+            os.remove(self.embeddings_path)
+
+    def abort(self):
+        """Discards the partial build, leaving the previous docstore untouched."""
+        self.data.close()
+        os.remove(self.data_path + ".tmp")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class DocStore:
+    """Read-only, memory-mapped view of a docstore built by DocStoreWriter."""
+
+    def __init__(self, path=DOCSTORE_DIR):
+        self.path = path
+        with open(os.path.join(path, TABLE_FILE), "r", encoding="utf-8") as f:
+            self.table = json.load(f)
+
+        self.file = open(os.path.join(path, DATA_FILE), "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        # mmap cannot map an empty file
+        self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        self.view = memoryview(self.buffer)
+
+    @staticmethod
+    def exists(path=DOCSTORE_DIR):
+        return os.path.exists(os.path.join(path, TABLE_FILE)) and os.path.exists(os.path.join(path, DATA_FILE))
+
+    def get(self, chunk_id):
+        """Returns the text of a chunk, or None if it is not in the store."""
+        entry = self.table.get(chunk_id)
+        if entry is None:
+            return None
+        offset, length, _ = entry
+        return str(self.view[offset:offset + length], "utf-8")
+
+    def source(self, chunk_id):
+        entry = self.table.get(chunk_id)
+        return entry[2] if entry else None
+
+    def ids(self, source=None):
+        """Lists chunk IDs, optionally only those from one source file."""
+        if source is None:
+            return list(self.table)
+        return [chunk_id for chunk_id, entry in self.table.items() if entry[2] == source]
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, chunk_id):
+        return chunk_id in self.table
+
+    def close(self):
+        self.view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        self.file.close()
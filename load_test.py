@@ -0,0 +1,424 @@
+"""
+Concurrent-Session Load Test for Kassalapp Assistant.
+
+Drives the chat pipeline used by app.py (chat_pipeline.answer_prompt: the RAG query,
+the Groq tool loop and execute_tool) with N concurrent simulated sessions, one thread
+per session like Streamlit, against local stand-ins for the upstream services:
+
+    Kassalapp  a local HTTP server; tools.py talks to it through requests as usual
+    Groq       an in-process fake client that requests one tool call, then answers
+    Pinecone   an in-process fake index serving chunks from knowledge/
+
+Every stand-in has a configurable latency and error rate. The encoder is the real
+SentenceTransformer when it is installed, since encode() and GIL contention are part of
+what is being measured (--fake-encoder swaps in a CPU-bound stand-in). For each
+concurrency level the report shows throughput, latency percentiles, errors, CPU use
+and RSS, so the point where one instance saturates is visible.
+
+The shared client-side rate limits are disabled unless --rate-limits is given, so the
+stand-ins (not the quotas) are what the sessions contend for.
+
+Usage:
+    python load_test.py --levels 1,2,4,8,16,32 --turns 3
+    python load_test.py --groq-latency-ms 800 --kassalapp-error-rate 0.05 --json report.json
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import random
+import hashlib
+import argparse
+import tempfile
+import threading
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+CHAINS = ["Kiwi", "Rema 1000", "Meny", "Spar", "Coop Extra", "Bunnpris"]
+
+# Prompts cycled through by the sessions, with the tool call the fake LLM makes for each
+SCENARIOS = [
+    ("Hva koster melk på Kiwi?", "search_products", {"search": "melk", "store": "Kiwi"}),
+    ("What is the price of Pepsi Max at Meny?", "search_products", {"search": "pepsi max", "store": "MENY"}),
+    ("Find a Kiwi store in Oslo.", "search_physical_stores", {"search": "Oslo", "group": "KIWI"}),
+    ("Where are melk, brød and egg cheapest?", "optimize_basket", {"items": ["melk", "brød", "egg"], "stores": ["KIWI", "REMA_1000", "MENY_NO"]}),
+    ("What is Trumf and how does it work?", None, None),
+]
+TOOL_CALLS = {prompt: (name, args) for prompt, name, args in SCENARIOS}
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class Upstream:
+    """Latency and failure model of one stand-in service."""
+
+    def __init__(self, name, latency_ms, jitter_ms=0.0, error_rate=0.0):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+
+    def call(self):
+        """Sleeps for one simulated round trip and fails with the configured probability."""
+        delay = max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000
+        time.sleep(delay)
+        if random.random() < self.error_rate:
+            raise UpstreamError(f"Simulated {self.name} failure")
+
+
+# --- Kassalapp stand-in -------------------------------------------------------------
+
+def _fake_product(search, i, store=None):
+    ean = str(7000000000000 + int(hashlib.md5(f"{search}{i}".encode()).hexdigest()[:8], 16) % 10**12)
+    base = 10 + int(ean[-3:]) % 60
+    return {
+        "name": f"{search.title()} {i + 1}",
+        "brand": "Testmerke",
+        "ean": ean,
+        "current_price": round(base * random.uniform(0.9, 1.1), 2),
+        "store": {"name": store or random.choice(CHAINS)},
+        "price_history": [
+            {"price": float(base + d), "date": f"2026-0{d}-01T00:00:00Z"} for d in range(1, 4)
+        ],
+    }
+
+
+def make_kassalapp_handler(upstream):
+    class KassalappHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            try:
+                upstream.call()
+            except UpstreamError:
+                self.send_error(503, "Simulated Kassalapp failure")
+                return
+
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            path = url.path.removeprefix("/api/v1")
+            if path == "/products":
+                size = int(params.get("size", 10))
+                body = {"data": [_fake_product(params.get("search", ""), i, params.get("store")) for i in range(size)]}
+            elif path.startswith("/products/ean/"):
+                ean = path.rsplit("/", 1)[-1]
+                body = {"data": {"ean": ean, "products": [_fake_product(ean, 0, chain) for chain in CHAINS]}}
+            elif path == "/physical-stores":
+                body = {"data": [
+                    {"id": i, "name": f"{params.get('group', 'KIWI')} {params.get('search', '')} {i}", "group": params.get("group"), "address": f"Gate {i}"}
+                    for i in range(int(params.get("size", 20)))
+                ]}
+            else:
+                self.send_error(404)
+                return
+
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return KassalappHandler
+
+
+def start_kassalapp_server(upstream):
+    """Starts the Kassalapp stand-in on a free local port and returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_kassalapp_handler(upstream))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/api/v1"
+
+
+# --- Groq and Pinecone stand-ins ----------------------------------------------------
+
+class FakeGroq:
+    """Mimics groq.Groq: the first completion of a turn asks for a tool, the next one answers."""
+
+    def __init__(self, upstream):
+        self.upstream = upstream
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, tools=None, **kwargs):
+        # Serializing the request is real client-side work
+        json.dumps([m for m in messages if isinstance(m, dict)] + (tools or []))
+        self.upstream.call()
+        self.calls += 1
+
+        last = messages[-1]
+        prompt = last["content"] if isinstance(last, dict) and last.get("role") == "user" else None
+        name, args = TOOL_CALLS.get(prompt, (None, None))
+        if name is None:
+            message = SimpleNamespace(content="Here is what I found (simulated answer).", tool_calls=None)
+        else:
+            call = SimpleNamespace(
+                id=f"call_{self.calls}",
+                function=SimpleNamespace(name=name, arguments=json.dumps(args))
+            )
+            message = SimpleNamespace(content=None, tool_calls=[call])
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class FakePineconeIndex:
+    """Mimics a Pinecone index, answering with chunks of the local knowledge files."""
+
+    def __init__(self, upstream, knowledge_dir="knowledge"):
+        self.upstream = upstream
+        self.chunks = []
+        if os.path.isdir(knowledge_dir):
+            for filename in sorted(os.listdir(knowledge_dir)):
+                with open(os.path.join(knowledge_dir, filename), "r", encoding="utf-8") as f:
+                    paragraphs = [p.strip() for p in f.read().split("\n\n") if p.strip()]
+                self.chunks += [(f"{filename}_{i}", filename, p) for i, p in enumerate(paragraphs)]
+        self.chunks = self.chunks or [("stub_0", "stub.md", "Trumf is a loyalty program.")]
+
+    def query(self, vector, top_k=3, include_metadata=True, filter=None):
+        self.upstream.call()
+        picks = random.sample(self.chunks, min(top_k, len(self.chunks)))
+        return {"matches": [
+            {"id": chunk_id, "score": 0.8 - 0.05 * rank, "metadata": {"text": text, "source": source}}
+            for rank, (chunk_id, source, text) in enumerate(picks)
+        ]}
+
+
+class FakeEncoder:
+    """CPU-bound stand-in for SentenceTransformer.encode that holds the GIL while it works."""
+
+    def __init__(self, cpu_ms, dim=384):
+        self.cpu_ms = cpu_ms
+        self.dim = dim
+
+    def encode(self, sentences, batch_size=32):
+        single = isinstance(sentences, str)
+        batch = [sentences] if single else list(sentences)
+        deadline = time.thread_time() + self.cpu_ms / 1000 * len(batch)
+        while time.thread_time() < deadline:
+            pass
+        vectors = np.random.default_rng().normal(size=(len(batch), self.dim)).astype(np.float32)
+        return vectors[0] if single else vectors
+
+
+# --- Measurement --------------------------------------------------------------------
+
+def current_rss():
+    """Resident set size of this process in bytes (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class ResourceSampler(threading.Thread):
+    """Samples process CPU time and RSS at a fixed interval."""
+
+    def __init__(self, interval=0.2):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.samples.append((time.perf_counter(), time.process_time(), current_rss()))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.samples.append((time.perf_counter(), time.process_time(), current_rss()))
+
+
+def run_session(session_id, turns, client, rag, model, think_ms, results):
+    """
+    One simulated user: a multi-turn conversation through the real pipeline.
+
+    Appends (latency, ok) per turn to `results` and returns the number of tool calls that failed.
+    """
+    from chat_pipeline import answer_prompt, run_tool
+
+    tool_errors = 0
+
+    def counting_tool_runner(name, args):
+        nonlocal tool_errors
+        result = run_tool(name, args)
+        if isinstance(result, dict) and "error" in result:
+            tool_errors += 1
+        return result
+
+    history = []
+    for turn in range(turns):
+        prompt = SCENARIOS[(session_id + turn) % len(SCENARIOS)][0]
+        history.append({"role": "user", "content": prompt})
+        start_time = time.perf_counter()
+        try:
+            answer = answer_prompt(client, rag, prompt, history, model, tool_runner=counting_tool_runner)
+            ok = True
+        except Exception:
+            answer, ok = None, False
+        results.append((time.perf_counter() - start_time, ok))
+        if answer:
+            history.append({"role": "assistant", "content": answer})
+        if think_ms:
+            time.sleep(think_ms / 1000)
+    return tool_errors
+
+
+def run_level(concurrency, turns, client, rag, model, think_ms):
+    """Runs `concurrency` sessions at once and summarizes the level."""
+    from rate_limit import KASSALAPP_FLIGHT
+
+    results = []
+    tool_errors = []
+    coalesced_before = KASSALAPP_FLIGHT.coalesced
+    sampler = ResourceSampler()
+    sampler.start()
+    start_time = time.perf_counter()
+    def session(session_id):
+        tool_errors.append(run_session(session_id, turns, client, rag, model, think_ms, results))
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start_time
+    sampler.stop()
+
+    latencies = np.array([latency for latency, _ in results])
+    ok = np.array([ok for _, ok in results])
+    samples = np.array(sampler.samples)
+    cpu = np.diff(samples[:, 1]) / np.maximum(np.diff(samples[:, 0]), 1e-9)
+    p50, p90, p95, p99 = np.percentile(latencies, [50, 90, 95, 99])
+    return {
+        "concurrency": concurrency,
+        "turns": int(len(latencies)),
+        "wall_s": round(wall, 2),
+        "throughput_turns_per_s": round(len(latencies) / wall, 2),
+        "latency_s": {
+            "p50": round(float(p50), 3), "p90": round(float(p90), 3), "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3), "max": round(float(latencies.max()), 3),
+        },
+        "turn_errors": int((~ok).sum()),
+        "tool_errors": int(sum(tool_errors)),
+        "coalesced_kassalapp_calls": KASSALAPP_FLIGHT.coalesced - coalesced_before,
+        "cpu_cores": {"mean": round(float((samples[-1, 1] - samples[0, 1]) / wall), 2), "peak": round(float(cpu.max()), 2) if len(cpu) else 0.0},
+        "rss_mb": {"start": round(samples[0, 2] / 1e6, 1), "peak": round(samples[:, 2].max() / 1e6, 1)},
+        "cpu_rss_curve": [
+            {"t_s": round(float(t - samples[0, 0]), 2), "cpu_cores": round(float(c), 2), "rss_mb": round(float(r) / 1e6, 1)}
+            for t, c, r in zip(samples[1:, 0], cpu, samples[1:, 2])
+        ],
+    }
+
+
+def print_report(levels):
+    print(f"\n{'sessions':>8}{'turns/s':>9}{'p50 s':>8}{'p90 s':>8}{'p95 s':>8}{'p99 s':>8}{'errors':>8}"
+          f"{'tool err':>9}{'coalesced':>10}{'cpu mean':>9}{'cpu peak':>9}{'rss MB':>8}")
+    for level in levels:
+        lat = level["latency_s"]
+        print(f"{level['concurrency']:>8}{level['throughput_turns_per_s']:>9.2f}{lat['p50']:>8.2f}{lat['p90']:>8.2f}"
+              f"{lat['p95']:>8.2f}{lat['p99']:>8.2f}{level['turn_errors']:>8}{level['tool_errors']:>9}"
+              f"{level['coalesced_kassalapp_calls']:>10}{level['cpu_cores']['mean']:>9.2f}{level['cpu_cores']['peak']:>9.2f}"
+              f"{level['rss_mb']['peak']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,2,4,8,16", help="Comma-separated concurrent session counts.")
+    parser.add_argument("--turns", type=int, default=3, help="Chat turns per session.")
+    parser.add_argument("--think-ms", type=float, default=0, help="Pause between a session's turns.")
+    parser.add_argument("--groq-latency-ms", type=float, default=400)
+    parser.add_argument("--groq-error-rate", type=float, default=0.0)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=40)
+    parser.add_argument("--pinecone-error-rate", type=float, default=0.0)
+    parser.add_argument("--kassalapp-latency-ms", type=float, default=150)
+    parser.add_argument("--kassalapp-error-rate", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.25, help="Latency standard deviation as a fraction of the mean.")
+    parser.add_argument("--fake-encoder", action="store_true", help="Use a CPU-bound stand-in instead of SentenceTransformer.")
+    parser.add_argument("--encoder-cpu-ms", type=float, default=8, help="CPU time per sentence of the fake encoder.")
+    parser.add_argument("--rate-limits", action="store_true", help="Keep the shared client-side rate limits enabled.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="PATH", help="Also write the full report (including CPU/RSS curves) as JSON.")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    # Keep the price history of the simulated traffic out of the real store, and remove it afterwards
+    with tempfile.TemporaryDirectory(prefix="kassalapp-load-test-") as history_dir:
+        os.environ["PRICE_HISTORY_DIR"] = history_dir
+        try:
+            run(args)
+        finally:
+            # Skip the exit-time flush, which would recreate the directory
+            price_history = sys.modules.get("price_history")
+            if price_history is not None:
+                atexit.unregister(price_history._history.flush)
+
+
+def run(args):
+    """Starts the stand-ins, builds the pipeline and runs every concurrency level."""
+    os.environ.setdefault("KASSALAPP_API_KEY", "load-test")
+
+    def upstream(name, latency_ms, error_rate):
+        return Upstream(name, latency_ms, latency_ms * args.jitter, error_rate)
+
+    kassalapp = upstream("kassalapp", args.kassalapp_latency_ms, args.kassalapp_error_rate)
+    server, base_url = start_kassalapp_server(kassalapp)
+
+    import tools
+    import rate_limit
+    from rag_engine import KassalappRAG
+
+    tools.BASE_URL = base_url
+    tools.KASSALAPP_API_KEY = "load-test"
+    if not args.rate_limits:
+        for name in rate_limit.LIMITERS:
+            rate_limit.LIMITERS[name] = rate_limit.TokenBucket(name, per_minute=1e12, burst=1e12)
+
+    if args.fake_encoder:
+        model = FakeEncoder(args.encoder_cpu_ms)
+    else:
+        try:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer('all-MiniLM-L6-v2')
+        except ImportError:
+            print("sentence_transformers is not installed, using the fake encoder.")
+            model = FakeEncoder(args.encoder_cpu_ms)
+
+    # The stand-in index serves its own chunks (text in metadata), so a local docstore/ from a
+    # real sync must not be consulted: its chunk IDs don't match
+    rag = KassalappRAG(
+        index=FakePineconeIndex(upstream("pinecone", args.pinecone_latency_ms, args.pinecone_error_rate)),
+        model=model,
+        use_docstore=False
+    )
+    client = FakeGroq(upstream("groq", args.groq_latency_ms, args.groq_error_rate))
+    model_name = "load-test"
+
+    # Warm up caches, connection pools and the encoder before measuring
+    run_session(0, 1, client, rag, model_name, 0, [])
+
+    levels = []
+    for concurrency in [int(level) for level in args.levels.split(",")]:
+        print(f"Running {concurrency} concurrent sessions x {args.turns} turns...")
+        levels.append(run_level(concurrency, args.turns, client, rag, model_name, args.think_ms))
+    print_report(levels)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "levels": levels}, f, indent=2)
+        print(f"\nFull report written to {args.json}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,491 @@
+"""
+Local Price History Store for Kassalapp Assistant.
+
+Every product payload returned by the Kassalapp tools (search results, EAN and ID
+lookups, including their embedded price_history) is appended to a compact columnar
+store, so questions like "has this gotten cheaper?" or "when is it on sale?" can be
+answered from local data instead of repeated API calls.
+
+The store is append-only. Rows are buffered in memory and flushed as immutable
+segment files (price_history/segment-*.npz) holding four NumPy columns:
+
+    ean    fixed-width bytes (S14)
+    store  int16 codes into the segment's own store-name table
+    ts     int64 Unix timestamp (seconds)
+    price  float32 price in NOK
+
+Once MAX_SMALL_SEGMENTS segments below SMALL_SEGMENT_BYTES have accumulated, they are
+compacted into one larger segment that lists the files it replaces, so readers in
+other processes never count a row twice. Queries load all segments once (only new
+segments are read afterwards) and are answered with vectorized NumPy group operations.
+
+Usage:
+    python price_history.py --crawl 7044610874661 [EAN ...] [--interval 3600]
+    python price_history.py --crawl-tracked [--interval 3600]
+    python price_history.py --stats 7044610874661 [--days 90]
+    python price_history.py --drops [--days 7]
+    python price_history.py --compact
+"""
+import os
+import sys
+import time
+import glob
+import atexit
+import argparse
+import threading
+from datetime import datetime
+import numpy as np
+
+PRICE_HISTORY_DIR = os.getenv("PRICE_HISTORY_DIR", "price_history")
+
+FLUSH_ROWS = 500           # Flush the buffer to a new segment after this many rows...
+FLUSH_SECONDS = 60         # ...or when the oldest buffered row is this old
+MIN_RECORD_INTERVAL = 3600  # Seconds before an unchanged (ean, store, price) is recorded again
+
+SMALL_SEGMENT_BYTES = 4 * 1024 * 1024  # Segments below this size are merged by compact()...
+MAX_SMALL_SEGMENTS = 16                # ...once this many of them exist
+COMPACT_LOCK_TIMEOUT = 600             # Seconds after which a leftover compaction lock is ignored
+
+EAN_DTYPE = "S14"
+DAY = 86400
+
+
+def _parse_timestamp(value, default):
+    """Converts an ISO date string (as used by the Kassalapp API) to a Unix timestamp."""
+    if not value:
+        return default
+    try:
+        return int(datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        return default
+
+
+def _store_name(store):
+    if isinstance(store, dict):
+        return store.get("name") or store.get("code")
+    return store
+
+
+def extract_rows(payload, now=None):
+    """
+    Extracts (ean, store, ts, price) rows from a Kassalapp tool response.
+
+    Understands the optimized search_products results, raw product payloads (with
+    current_price and price_history) and EAN lookups (a product list per store).
+    """
+    now = int(now or time.time())
+    rows = []
+
+    def visit_product(product, ean=None):
+        ean = product.get("ean") or ean
+        store = _store_name(product.get("store"))
+        if not ean or not store:
+            return
+        # Optimized search results carry the price as a plain number, raw payloads as a dict
+        # with its own date. Use that date (it matches the price_history point for the same
+        # observation) and fall back to the product's update time, then now, without one.
+        price = product.get("current_price", product.get("price"))
+        ts = _parse_timestamp(product.get("updated_at"), now)
+        if isinstance(price, dict):
+            ts = _parse_timestamp(price.get("date"), ts)
+            price = price.get("price")
+        if isinstance(price, (int, float)):
+            rows.append((ean, store, ts, float(price)))
+        for point in product.get("price_history") or []:
+            if isinstance(point.get("price"), (int, float)) and point.get("date"):
+                rows.append((ean, store, _parse_timestamp(point["date"], now), float(point["price"])))
+
+    data = payload.get("data", payload) if isinstance(payload, dict) else payload
+    for item in data if isinstance(data, list) else [data]:
+        if not isinstance(item, dict):
+            continue
+        if isinstance(item.get("products"), list):
+            # EAN lookup: one entry per store selling the product
+            for product in item["products"]:
+                if isinstance(product, dict):
+                    visit_product(product, item.get("ean"))
+        else:
+            visit_product(item)
+    return rows
+
+
+def _write_segment(path, eans, stores, timestamps, prices, replaces=()):
+    """Atomically writes one segment file and returns its path."""
+    store_names, store_codes = np.unique(np.asarray(stores, dtype=str), return_inverse=True)
+    os.makedirs(path, exist_ok=True)
+    name = f"segment-{time.time_ns()}-{os.getpid()}.npz"
+    tmp_path = os.path.join(path, name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(
+            f,
+            ean=np.asarray(eans, dtype=EAN_DTYPE),
+            store=store_codes.astype(np.int16),
+            store_names=store_names,
+            ts=np.asarray(timestamps, dtype=np.int64),
+            price=np.asarray(prices, dtype=np.float32),
+            replaces=np.asarray(replaces, dtype=str),
+        )
+    # Readers only ever see complete segments
+    os.replace(tmp_path, os.path.join(path, name))
+    return os.path.join(path, name)
+
+
+def _read_segment(segment):
+    """Returns (columns, names of the segments it replaces) for one segment file."""
+    with np.load(segment) as data:
+        columns = {
+            "ean": data["ean"],
+            "store": data["store_names"].astype(object)[data["store"]],
+            "ts": data["ts"],
+            "price": data["price"],
+        }
+        replaces = set(data["replaces"].tolist()) if "replaces" in data.files else set()
+    return columns, replaces
+
+
+class PriceHistory:
+    """Append-only columnar price store backed by NumPy segment files."""
+
+    def __init__(self, path=PRICE_HISTORY_DIR):
+        self.path = path
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.buffer_started = None
+
+        # Known (ean, store, ts) points and the latest (ts, price) per (ean, store), built on first record
+        self.seen = None
+        self.latest = None
+
+        # Columns of all segments loaded so far
+        self._reset_columns()
+
+    def _reset_columns(self):
+        self.loaded_segments = set()
+        self.columns = {
+            "ean": np.empty(0, dtype=EAN_DTYPE),
+            "store": np.empty(0, dtype=object),
+            "ts": np.empty(0, dtype=np.int64),
+            "price": np.empty(0, dtype=np.float32),
+        }
+
+    def _seed(self):
+        """Indexes the rows already on disk so re-fetched history points are not stored twice."""
+        if self.seen is not None:
+            return
+        columns = self.load()
+        seen, latest = set(), {}
+        for ean, store, ts, price in zip(columns["ean"].astype(str), columns["store"], columns["ts"].tolist(), columns["price"].tolist()):
+            seen.add((ean, store, ts))
+            if (ean, store) not in latest or ts >= latest[(ean, store)][0]:
+                latest[(ean, store)] = (ts, price)
+        with self.lock:
+            if self.seen is None:
+                self.seen, self.latest = seen, latest
+
+    def record(self, rows):
+        """Buffers new rows, skipping known points and prices re-observed unchanged very recently."""
+        self._seed()
+        with self.lock:
+            for ean, store, ts, price in rows:
+                ean = str(ean)
+                if (ean, store, ts) in self.seen:
+                    continue
+                latest = self.latest.get((ean, store))
+                if latest is not None and latest[1] == price and abs(ts - latest[0]) < MIN_RECORD_INTERVAL:
+                    continue
+                self.seen.add((ean, store, ts))
+                if latest is None or ts >= latest[0]:
+                    self.latest[(ean, store)] = (ts, price)
+                self.buffer.append((ean, store, ts, price))
+
+            if self.buffer and self.buffer_started is None:
+                self.buffer_started = time.time()
+            should_flush = len(self.buffer) >= FLUSH_ROWS or (
+                self.buffer_started is not None and time.time() - self.buffer_started >= FLUSH_SECONDS
+            )
+        if should_flush:
+            self.flush()
+
+    def _segments(self):
+        return set(glob.glob(os.path.join(self.path, "segment-*.npz")))
+
+    def _small_segments(self):
+        small = []
+        for segment in self._segments():
+            try:
+                if os.path.getsize(segment) < SMALL_SEGMENT_BYTES:
+                    small.append(segment)
+            except OSError:
+                pass  # Removed by a concurrent compaction
+        return sorted(small)
+
+    def flush(self):
+        """Writes the buffered rows to a new immutable segment, compacting small segments when needed."""
+        # Held while writing so load() never sees the rows in neither the buffer nor a segment
+        with self.lock:
+            if not self.buffer:
+                return
+            _write_segment(self.path, *zip(*self.buffer))
+            self.buffer, self.buffer_started = [], None
+
+        if len(self._small_segments()) >= MAX_SMALL_SEGMENTS:
+            self.compact()
+
+    def compact(self):
+        """
+        Merges all small segments into one (sorted by EAN and time). Returns the number
+        of segments merged.
+
+        The merged segment is written before the originals are removed and records their
+        names, so a concurrent reader skips whichever copy it would otherwise count twice.
+        A lock file keeps two processes from compacting the same segments.
+        """
+        lock_path = os.path.join(self.path, "compact.lock")
+        try:
+            if time.time() - os.path.getmtime(lock_path) > COMPACT_LOCK_TIMEOUT:
+                os.remove(lock_path)  # Left behind by a crashed process
+        except OSError:
+            pass
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return 0  # Another process is compacting
+
+        try:
+            small = self._small_segments()
+            if len(small) < 2:
+                return 0
+            parts, replaced = [], set()
+            for segment in small:
+                columns, replaces = _read_segment(segment)
+                parts.append(columns)
+                replaced |= replaces
+            merged = {key: np.concatenate([p[key] for p in parts]) for key in parts[0]}
+            order = np.lexsort((merged["ts"], merged["ean"]))
+            # Keep the names of files an earlier compaction replaced, in case a reader has not caught up
+            replaces = sorted(replaced | {os.path.basename(s) for s in small})
+            _write_segment(
+                self.path,
+                merged["ean"][order], merged["store"][order].astype(str), merged["ts"][order], merged["price"][order],
+                replaces=replaces,
+            )
+            for segment in small:
+                os.remove(segment)
+            print(f"Compacted {len(small)} price history segments ({len(order)} rows).")
+            return len(small)
+        finally:
+            os.remove(lock_path)
+
+    def load(self):
+        """Returns all columns (flushed segments plus the unflushed buffer) as NumPy arrays."""
+        with self.lock:
+            # Segments are immutable, so only files written since the last call are read
+            segments = self._segments()
+            new_segments = sorted(segments - self.loaded_segments)
+            if new_segments:
+                parts = [self.columns]
+                replaced = set()
+                for segment in new_segments:
+                    columns, replaces = _read_segment(segment)
+                    parts.append(columns)
+                    replaced |= replaces
+
+                if not replaced:
+                    self.columns = {key: np.concatenate([p[key] for p in parts]) for key in self.columns}
+                    self.loaded_segments.update(new_segments)
+                else:
+                    # A compaction merged segments: rebuild from the current files, skipping
+                    # originals that are still around next to their merged copy
+                    live = [p for p, segment in zip(parts[1:], new_segments) if os.path.basename(segment) not in replaced]
+                    kept = sorted(s for s in segments - set(new_segments) if os.path.basename(s) not in replaced)
+                    live += [_read_segment(segment)[0] for segment in kept]
+                    self._reset_columns()
+                    self.columns = {key: np.concatenate([self.columns[key]] + [p[key] for p in live]) for key in self.columns}
+                    self.loaded_segments = segments
+
+            columns = self.columns
+            if not self.buffer:
+                return columns
+            eans, stores, timestamps, prices = zip(*self.buffer)
+
+        return {
+            "ean": np.concatenate([columns["ean"], np.array(eans, dtype=EAN_DTYPE)]),
+            "store": np.concatenate([columns["store"], np.array(stores, dtype=object)]),
+            "ts": np.concatenate([columns["ts"], np.array(timestamps, dtype=np.int64)]),
+            "price": np.concatenate([columns["price"], np.array(prices, dtype=np.float32)]),
+        }
+
+    def tracked_eans(self):
+        """All EANs with at least one recorded price."""
+        return [ean.decode() for ean in np.unique(self.load()["ean"])]
+
+    def price_stats(self, ean, days=90, store=None, now=None):
+        """
+        Min/max/median/latest price per store for one product over the last `days` days.
+        """
+        now = int(now or time.time())
+        columns = self.load()
+        mask = (columns["ean"] == str(ean).encode()) & (columns["ts"] >= now - days * DAY)
+        if store:
+            mask &= np.char.lower(columns["store"].astype(str)) == store.lower()
+        stores, ts, prices = columns["store"][mask], columns["ts"][mask], columns["price"][mask]
+        if len(prices) == 0:
+            return []
+
+        # Group by store, ordered by price within each group for the medians
+        names, groups = np.unique(stores.astype(str), return_inverse=True)
+        order = np.lexsort((prices, groups))
+        sorted_prices, sorted_groups = prices[order], groups[order]
+        starts = np.flatnonzero(np.r_[True, np.diff(sorted_groups) != 0])
+        counts = np.diff(np.r_[starts, len(sorted_prices)])
+        minimum = sorted_prices[starts]
+        maximum = sorted_prices[starts + counts - 1]
+        median = (sorted_prices[starts + (counts - 1) // 2] + sorted_prices[starts + counts // 2]) / 2
+
+        # Latest observation per store
+        by_time = np.lexsort((ts, groups))
+        last = by_time[np.r_[np.flatnonzero(np.diff(groups[by_time]) != 0), len(by_time) - 1]]
+
+        return [
+            {
+                "store": str(names[g]),
+                "min": round(float(minimum[g]), 2),
+                "max": round(float(maximum[g]), 2),
+                "median": round(float(median[g]), 2),
+                "latest": round(float(prices[last[g]]), 2),
+                "latest_date": datetime.fromtimestamp(int(ts[last[g]])).date().isoformat(),
+                "observations": int(counts[g]),
+            }
+            for g in range(len(names))
+        ]
+
+    def price_drops(self, days=7, min_drop_pct=5.0, ean=None, store=None, now=None, limit=20):
+        """
+        Finds (product, store) pairs whose latest price is at least `min_drop_pct` percent
+        below their highest price in the preceding `days` days.
+        """
+        now = int(now or time.time())
+        columns = self.load()
+        mask = columns["ts"] >= now - days * DAY
+        if ean:
+            mask &= columns["ean"] == str(ean).encode()
+        if store:
+            mask &= np.char.lower(columns["store"].astype(str)) == store.lower()
+        eans, stores = columns["ean"][mask], columns["store"][mask].astype(str)
+        ts, prices = columns["ts"][mask], columns["price"][mask]
+        if len(prices) == 0:
+            return []
+
+        # One group per (ean, store), rows ordered by time within each group
+        _, groups = np.unique(np.char.add(np.char.add(eans.astype(str), "|"), stores), return_inverse=True)
+        order = np.lexsort((ts, groups))
+        groups, eans, stores, ts, prices = groups[order], eans[order], stores[order], ts[order], prices[order]
+        starts = np.flatnonzero(np.r_[True, np.diff(groups) != 0])
+        ends = np.r_[starts[1:], len(groups)] - 1
+
+        peak = np.maximum.reduceat(prices, starts)
+        latest = prices[ends]
+        drop_pct = np.where(peak > 0, (peak - latest) / peak * 100, 0.0)
+
+        hits = np.flatnonzero(drop_pct >= min_drop_pct)
+        hits = hits[np.argsort(-drop_pct[hits])][:limit]
+        return [
+            {
+                "ean": eans[ends[h]].decode(),
+                "store": str(stores[ends[h]]),
+                "previous_high": round(float(peak[h]), 2),
+                "latest": round(float(latest[h]), 2),
+                "drop_pct": round(float(drop_pct[h]), 1),
+                "latest_date": datetime.fromtimestamp(int(ts[ends[h]])).date().isoformat(),
+            }
+            for h in hits
+        ]
+
+
+# Process-wide store shared by all sessions
+_history = PriceHistory()
+atexit.register(_history.flush)
+
+
+def record_payload(payload):
+    """Records the prices in a Kassalapp tool response. Never raises."""
+    try:
+        rows = extract_rows(payload)
+        if rows:
+            _history.record(rows)
+    except Exception as e:
+        print(f"Error recording price history: {e}")
+
+
+def get_price_history(ean: str = None, days: int = 90, store: str = None, **kwargs):
+    """
+    Price trend for a product from locally recorded prices.
+
+    Args:
+        ean: Product EAN barcode. Omit to list recent price drops across all tracked products.
+        days: Time window in days.
+        store: Optional store name filter (e.g. "Kiwi").
+    """
+    ean = ean or kwargs.get("barcode")
+    try:
+        days = int(days)
+    except (ValueError, TypeError):
+        days = 90
+
+    if not ean:
+        return {"data": {"price_drops": _history.price_drops(days=days, store=store)}}
+
+    stats = _history.price_stats(ean, days=days, store=store)
+    if not stats:
+        return {"error": "No history", "message": f"No recorded prices for EAN {ean} in the last {days} days. Look it up with search_products first."}
+    return {"data": {"ean": ean, "days": days, "stores": stats, "price_drops": _history.price_drops(days=days, ean=ean, store=store)}}
+
+
+def crawl(eans):
+    """Fetches the given EANs from the Kassalapp API (recording their prices) and flushes."""
+    from tools import get_product_by_ean
+
+    for ean in eans:
+        result = get_product_by_ean(ean)
+        if "error" in result:
+            print(f"Failed to crawl EAN {ean}: {result['message']}")
+    _history.flush()
+    print(f"Crawled {len(eans)} products.")
+
+
+def main():
+    import json
+
+    parser = argparse.ArgumentParser(description="Local price history store.")
+    parser.add_argument("--crawl", nargs="+", metavar="EAN", help="Fetch and record these EANs.")
+    parser.add_argument("--crawl-tracked", action="store_true", help="Fetch and record every EAN already in the store.")
+    parser.add_argument("--interval", type=int, help="Repeat the crawl every N seconds.")
+    parser.add_argument("--stats", metavar="EAN", help="Print price statistics for an EAN.")
+    parser.add_argument("--drops", action="store_true", help="Print recent price drops.")
+    parser.add_argument("--store", help="Limit --stats and --drops to one store.")
+    parser.add_argument("--compact", action="store_true", help="Merge the small segment files now.")
+    parser.add_argument("--days", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.crawl or args.crawl_tracked:
+        while True:
+            crawl(args.crawl or _history.tracked_eans())
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+    elif args.stats:
+        print(json.dumps(get_price_history(args.stats, days=args.days or 90, store=args.store), indent=2, ensure_ascii=False))
+    elif args.drops:
+        print(json.dumps(_history.price_drops(days=args.days or 7, store=args.store), indent=2, ensure_ascii=False))
+    elif args.compact:
+        print(f"Merged {_history.compact()} segments.")
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    # Run on the imported module rather than this __main__ copy: tools.py records into
+    # price_history._history, so that is the store crawl() has to flush
+    import price_history
+    price_history.main()
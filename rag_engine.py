@@ -1,19 +1,80 @@
 import os
 import time
-import streamlit as st
-from pinecone import Pinecone
-from sentence_transformers import SentenceTransformer
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from dotenv import load_dotenv
+from rate_limit import acquire
+from docstore import DocStore, lean_metadata
+from vector_index import LocalVectorIndex
 
 # Load environment variables
 load_dotenv()
 
 class KassalappRAG:
-    def __init__(self):
-        """Initializes the RAG engine using Pinecone cloud."""
+    def __init__(self, index=None, model=None, use_docstore=True):
+        """
+        Initializes the RAG engine using Pinecone cloud (or a local index, see LOCAL_INDEX_MODE).
+
+        Args:
+            index: Optional pre-built index with Pinecone's query() API, used instead of connecting.
+            model: Optional pre-loaded encoder with SentenceTransformer's encode() API.
+            use_docstore: Read chunk text from the local docstore when present. Disable it for an
+                injected index whose chunk IDs do not match the docstore (the local index needs it).
+        """
+        self.local_index = None
+        self.index = None
+        local_mode = os.getenv("LOCAL_INDEX_MODE")
+        if index is not None:
+            self.index_name = type(index).__name__
+            self.index = index
+        elif local_mode:
+            # Search a local (optionally quantized) index built by sync_to_pinecone.py instead of
+            # Pinecone when LOCAL_INDEX_MODE is set to float32, float16 or binary
+            if not LocalVectorIndex.exists():
+                raise RuntimeError(
+                    f"LOCAL_INDEX_MODE is '{local_mode}' but no local embeddings were found. "
+                    "Run 'sync_to_pinecone.py' first to build the docstore."
+                )
+            self.index_name = f"local ({local_mode})"
+            self.local_index = LocalVectorIndex.from_docstore(mode=local_mode)
+        else:
+            self._connect_pinecone()
+        
+        # Load embedding model locally with timing
+        if model is not None:
+            self.model = model
+        else:
+            # Heavy dependency (torch) imported here rather than at module level,
+            # so importing this module stays cheap (see startup.py)
+            from sentence_transformers import SentenceTransformer
+
+            print("Loading embedding model for retrieval...")
+            start_time = time.time()
+            self.model = SentenceTransformer('all-MiniLM-L6-v2')
+            duration = time.time() - start_time
+            print(f"Model loaded in {duration:.2f} seconds.")
+
+        # In lean mode (PINECONE_LEAN_METADATA) Pinecone only returns IDs and scores and the
+        # chunk text is read from the local docstore built by sync_to_pinecone.py. Otherwise the
+        # docstore is only a fallback for matches without text in their metadata.
+        self.lean = lean_metadata() and use_docstore
+        use_docstore = use_docstore or self.local_index is not None
+        self.docstore = DocStore() if use_docstore and DocStore.exists() else None
+        if self.docstore is not None:
+            print(f"Using local docstore with {len(self.docstore)} chunks.")
+        elif self.lean and self.local_index is None:
+            print("Warning: PINECONE_LEAN_METADATA is set but no local docstore was found. Run 'sync_to_pinecone.py --lean' first.")
+        if self.local_index is not None:
+            self.local_sources = np.array([self.docstore.source(chunk_id) for chunk_id in self.local_index.ids], dtype=object)
+
+    def _connect_pinecone(self):
+        """Connects to the Pinecone cloud index."""
+        from pinecone import Pinecone
+
         # Universal Secrets: Try Streamlit Secrets (Cloud), then Environment Variables (Local)
         # We wrap this in a safe check to avoid crashes when running as a standalone script
         try:
+            import streamlit as st
             self.api_key = st.secrets.get("PINECONE_API_KEY") or os.getenv("PINECONE_API_KEY")
             self.index_name = st.secrets.get("PINECONE_INDEX_NAME") or os.getenv("PINECONE_INDEX_NAME")
         except Exception:
@@ -40,40 +101,126 @@ class KassalappRAG:
                 f"Unable to connect to Pinecone index '{self.index_name}'. "
                 "Ensure you have run 'sync_to_pinecone.py' first to initialize the cloud database."
             ) from e
-        
-        # Load embedding model locally with timing
-        print("Loading embedding model for retrieval...")
-        start_time = time.time()
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
-        duration = time.time() - start_time
-        print(f"Model loaded in {duration:.2f} seconds.")
 
-    # Top-k retrieval chunks value can be experimented with 
-    # for larger values Re-ranking strategy should be considered
-    def query(self, user_query, n_results=3):
-        """Retrieves relevant chunks from Pinecone cloud."""
-        # 1. Generate embedding for the query
-        query_vector = self.model.encode(user_query).tolist()
-        
-        # 2. Query Pinecone
+    def _local_rows(self, source):
+        """Rows of the local index that belong to the given source file(s), or None for all."""
+        if not source:
+            return None
+        sources = list(source) if isinstance(source, (list, tuple)) else [source]
+        return np.flatnonzero(np.isin(self.local_sources, sources))
+
+    def _search(self, query_vector, n_results, source=None):
+        """Runs a single lookup on the local index or Pinecone, returning an empty result on failure."""
+        if self.local_index is not None:
+            return self.local_index.query(query_vector, n_results, rows=self._local_rows(source))[0]
+
+        # Scope the search to one or more knowledge files
+        query_filter = None
+        if isinstance(source, (list, tuple)):
+            query_filter = {"source": {"$in": list(source)}}
+        elif source:
+            query_filter = {"source": {"$eq": source}}
+
         try:
-            results = self.index.query(
+            acquire("pinecone")
+            return self.index.query(
                 vector=query_vector,
                 top_k=n_results,
-                include_metadata=True
+                include_metadata=not self.lean,
+                filter=query_filter
             )
         except Exception as e:
             print(f"Error querying Pinecone index '{self.index_name}': {e}")
-            return []
+            return {}
+
+    def _chunk_text(self, match):
+        """Returns the chunk text of a match from its metadata or the local docstore."""
+        metadata = match.get("metadata") or {}
+        if "text" in metadata:
+            return metadata["text"]
+        text = self.docstore.get(match.get("id")) if self.docstore is not None else None
+        if text is None:
+            print(f"Warning: no text for chunk '{match.get('id')}'. The local docstore may be stale, re-run 'sync_to_pinecone.py'.")
+        return text
+
+    def _chunk_source(self, match):
+        """Returns the source file of a match from its metadata or the local docstore."""
+        metadata = match.get("metadata") or {}
+        if "source" in metadata:
+            return metadata["source"]
+        if self.docstore is not None:
+            return self.docstore.source(match.get("id"))
+        return None
+
+    # Top-k retrieval chunks value can be experimented with 
+    # for larger values Re-ranking strategy should be considered
+    def query(self, user_query, n_results=3, source=None):
+        """Retrieves relevant chunks from Pinecone cloud, optionally limited to one source file."""
+        # 1. Generate embedding for the query
+        query_vector = self.model.encode(user_query).tolist()
+        
+        # 2. Query Pinecone
+        results = self._search(query_vector, n_results, source)
         
-        # 3. Extract text from metadata
+        # 3. Extract text from metadata (or the local docstore)
         relevant_chunks = []
         for match in results.get("matches", []):
-            if "text" in match.get("metadata", {}):
-                relevant_chunks.append(match["metadata"]["text"])
+            text = self._chunk_text(match)
+            if text:
+                relevant_chunks.append(text)
         
         return relevant_chunks
 
+    def query_batch(self, user_queries, n_results=3, max_workers=4, source=None):
+        """
+        Retrieves relevant chunks for several queries at once.
+
+        All queries are embedded in one model call and the Pinecone lookups run
+        concurrently (or are answered in a single pass over the local index).
+        Returns one list per query of {"id", "score", "text", "source"} dicts,
+        deduplicated by chunk and ordered by descending score.
+        """
+        user_queries = list(user_queries)
+        if not user_queries:
+            return []
+
+        # 1. Generate all embeddings in a single vectorized call
+        query_vectors = self.model.encode(user_queries, batch_size=32)
+
+        # 2. Query the local index in one matrix multiply, or Pinecone concurrently
+        if self.local_index is not None:
+            responses = self.local_index.query(query_vectors, n_results, rows=self._local_rows(source))
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(user_queries))) as executor:
+                responses = list(executor.map(
+                    lambda vector: self._search(vector.tolist(), n_results, source),
+                    query_vectors
+                ))
+
+        # 3. Extract and deduplicate annotated chunks per query
+        batch_results = []
+        for results in responses:
+            seen_ids = set()
+            seen_texts = set()
+            chunks = []
+            for match in results.get("matches", []):
+                text = self._chunk_text(match)
+                # The same chunk can be indexed twice (e.g. a renamed file), keep the best hit
+                if not text or match.get("id") in seen_ids or text in seen_texts:
+                    continue
+                seen_ids.add(match.get("id"))
+                seen_texts.add(text)
+                chunks.append({
+                    "id": match.get("id"),
+                    "score": match.get("score"),
+                    "text": text,
+                    "source": self._chunk_source(match)
+                })
+            chunks.sort(key=lambda c: c["score"] or 0.0, reverse=True)
+            batch_results.append(chunks)
+
+        return batch_results
+
 if __name__ == "__main__":
     # Test script for Pinecone retrieval
     try:
@@ -90,6 +237,13 @@ if __name__ == "__main__":
                 print(res)
         else:
             print("No relevant knowledge found in cloud index.")
+
+        batch_queries = ["What is Trumf?", "Hva er Trumf bonus?", "Which stores accept Trumf?"]
+        print(f"\nTesting Batch Query: {batch_queries}")
+        for batch_query, matches in zip(batch_queries, rag.query_batch(batch_queries)):
+            print(f"\n--- {batch_query} ---")
+            for match in matches:
+                print(f"[{match['score']:.3f}] {match['source']} ({match['id']})")
             
     except Exception as e:
         print(f"Error: {str(e)}")
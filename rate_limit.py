@@ -0,0 +1,238 @@
+"""
+Client-side Rate Limiting for Kassalapp Assistant.
+
+All chat sessions served by one process share a token bucket per upstream service
+(Kassalapp, Groq, Pinecone), so peaks are smoothed into a queue instead of surfacing
+as quota errors. Identical in-flight requests (e.g. two users searching "pepsi max"
+at the same moment) are coalesced with single-flight: the first caller does the work
+and every concurrent duplicate receives a copy of its response.
+
+Fan-out work such as the basket optimizer runs at background priority (see
+background()): it only takes tokens the bucket has to spare beyond a small reserve
+and never queues ahead of interactive calls, so one large request cannot make every
+other session wait behind it. Callers estimate the wait of a fan-out up front with
+estimate_wait() and refuse it instead of blocking when the quota cannot absorb it.
+
+Limits are configured in requests per minute and can be overridden with the
+KASSALAPP_RATE_LIMIT, GROQ_RATE_LIMIT and PINECONE_RATE_LIMIT environment variables.
+"""
+import os
+import copy
+import time
+import threading
+from contextlib import contextmanager
+from concurrent.futures import Future
+
+# Priority of the calling thread (see background())
+_local = threading.local()
+
+
+class TokenBucket:
+    """Thread-safe token bucket. Callers block until a token is available."""
+
+    def __init__(self, name, per_minute, burst, reserve=0):
+        """
+        Args:
+            name: Service name used in metrics.
+            per_minute: Sustained request rate.
+            burst: Bucket capacity.
+            reserve: Tokens background callers leave untouched for interactive callers.
+        """
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst)
+        self.reserve = min(float(reserve), self.capacity - 1)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.background_waiting = 0
+
+        # Metrics
+        self.calls = 0
+        self.background_calls = 0
+        self.waited_calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _record(self, wait):
+        self.calls += 1
+        if wait > 0:
+            self.waited_calls += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def acquire(self, background=False):
+        """Takes one token, sleeping until it is available. Returns the time spent queued."""
+        if background:
+            return self._acquire_background()
+
+        with self.lock:
+            self._refill()
+            # Reserve the token up front so waiters are served in arrival order
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            self._record(wait)
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def _acquire_background(self):
+        """Takes a spare token above the reserve without going into debt, so interactive callers keep priority."""
+        start_time = time.monotonic()
+        waited = False
+        with self.lock:
+            self.background_waiting += 1
+        try:
+            while True:
+                with self.lock:
+                    self._refill()
+                    if self.tokens >= 1 + self.reserve:
+                        self.tokens -= 1
+                        wait = time.monotonic() - start_time if waited else 0.0
+                        self._record(wait)
+                        self.background_calls += 1
+                        return wait
+                    shortfall = 1 + self.reserve - self.tokens
+                waited = True
+                time.sleep(shortfall / self.rate)
+        finally:
+            with self.lock:
+                self.background_waiting -= 1
+
+    def estimate_wait(self, calls):
+        """Seconds until `calls` more background calls would have been served, at the current load."""
+        with self.lock:
+            self._refill()
+            needed = self.background_waiting + calls + self.reserve - self.tokens
+            return max(0.0, needed / self.rate)
+
+    def max_calls(self, max_wait):
+        """Largest background fan-out an idle bucket serves within `max_wait` seconds."""
+        return int(self.capacity - self.reserve + max_wait * self.rate)
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "limit_per_minute": round(self.rate * 60, 2),
+                "calls": self.calls,
+                "background_calls": self.background_calls,
+                "queued_calls": self.waited_calls,
+                "total_queue_wait_s": round(self.total_wait, 3),
+                "avg_queue_wait_s": round(self.total_wait / self.calls, 3) if self.calls else 0.0,
+                "max_queue_wait_s": round(self.max_wait, 3),
+            }
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into one execution."""
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+        # Metrics
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        """Runs fn() unless an identical call is already in flight, in which case its result is shared."""
+        with self.lock:
+            self.calls += 1
+            future = self.in_flight.get(key)
+            if future is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                future = Future()
+                self.in_flight[key] = future
+                leader = True
+
+        if not leader:
+            # Hand out a copy so callers can't mutate each other's response
+            return copy.deepcopy(future.result())
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "requests": self.calls,
+                "coalesced_calls": self.coalesced,
+                "in_flight": len(self.in_flight),
+            }
+
+
+def _limit_from_env(name, default):
+    """Reads a requests-per-minute limit, falling back to the default for invalid or non-positive values."""
+    value = os.getenv(name)
+    if value is None:
+        return float(default)
+    try:
+        limit = float(value)
+    except ValueError:
+        limit = 0.0
+    if limit > 0:
+        return limit
+    print(f"Ignoring invalid {name}={value!r}, using {default} requests/minute.")
+    return float(default)
+
+
+# Process-wide limiters, one per upstream service (requests per minute, burst size, interactive reserve)
+LIMITERS = {
+    "kassalapp": TokenBucket("kassalapp", _limit_from_env("KASSALAPP_RATE_LIMIT", 60), burst=10, reserve=2),
+    "groq": TokenBucket("groq", _limit_from_env("GROQ_RATE_LIMIT", 30), burst=5, reserve=1),
+    "pinecone": TokenBucket("pinecone", _limit_from_env("PINECONE_RATE_LIMIT", 600), burst=20, reserve=4),
+}
+
+# Process-wide request coalescing for the Kassalapp tools
+KASSALAPP_FLIGHT = SingleFlight("kassalapp")
+
+
+@contextmanager
+def background():
+    """Runs the calls made by this thread at background priority (e.g. inside a fan-out worker)."""
+    previous = getattr(_local, "background", False)
+    _local.background = True
+    try:
+        yield
+    finally:
+        _local.background = previous
+
+
+def acquire(service):
+    """Blocks until the named upstream service may be called."""
+    return LIMITERS[service].acquire(background=getattr(_local, "background", False))
+
+
+def estimate_wait(service, calls):
+    """Estimated queue time in seconds for a fan-out of `calls` background calls to the service."""
+    return LIMITERS[service].estimate_wait(calls)
+
+
+def max_calls(service, max_wait):
+    """Largest fan-out of background calls to the service that fits in `max_wait` seconds when idle."""
+    return LIMITERS[service].max_calls(max_wait)
+
+
+def get_metrics():
+    """Returns queue-wait and coalescing metrics for all upstream services."""
+    metrics = {name: limiter.metrics() for name, limiter in LIMITERS.items()}
+    metrics["kassalapp"].update(KASSALAPP_FLIGHT.metrics())
+    return metrics
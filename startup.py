@@ -0,0 +1,200 @@
+"""
+Startup Helpers for Kassalapp Assistant.
+
+Keeps the first frame fast on cold starts (e.g. scaled-to-zero hosting). The heavy
+modules (groq, pinecone, sentence_transformers/torch) are imported and the RAG engine
+is built in a background thread while the UI is already interactive. The engine is
+shared by every session in the process, and each warm-up step is timed.
+
+Running this file prints an import-time breakdown of the app's dependencies (each
+measured in a fresh interpreter with `python -X importtime`) so startup regressions
+are visible.
+
+Usage:
+    python startup.py [module ...]
+"""
+import os
+import sys
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Modules profiled by default, roughly in the order app.py needs them
+PROFILED_MODULES = [
+    "streamlit",
+    "dotenv",
+    "requests",
+    "numpy",
+    "groq",
+    "pinecone",
+    "sentence_transformers",
+    "price_history",
+    "tools",
+    "basket",
+    "chat_pipeline",
+    "rag_engine",
+]
+
+
+def _process_start_time():
+    """Wall-clock time the process was created (from /proc on Linux), or None if unknown."""
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22 is the start time in clock ticks after boot; the command name may contain spaces
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+# Reference point of the "since ..." timings: process creation where the OS exposes it,
+# otherwise the first import of this module (which misses interpreter and Streamlit boot)
+PROCESS_START = _process_start_time()
+SINCE = "since process start"
+if PROCESS_START is None:
+    PROCESS_START = time.time()
+    SINCE = "since startup.py import"
+
+_lock = threading.Lock()
+_timings = {}
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warmup")
+_rag_future = None
+
+
+class timed:
+    """Context manager that records how long a startup step took."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self.start)
+
+
+def record(name, seconds):
+    with _lock:
+        _timings[name] = seconds
+
+
+def mark_first_frame():
+    """Records the time from process start to the end of the first script run."""
+    with _lock:
+        _timings.setdefault(f"first frame ({SINCE})", time.time() - PROCESS_START)
+
+
+def get_timings():
+    """Returns the recorded startup steps in seconds, in the order they finished."""
+    with _lock:
+        return {name: round(seconds, 3) for name, seconds in _timings.items()}
+
+
+def _warmup():
+    """Imports the heavy dependencies and builds the RAG engine."""
+    with timed("import groq"):
+        import groq  # noqa: F401
+    with timed("import pinecone"):
+        import pinecone  # noqa: F401
+    with timed("import sentence_transformers"):
+        import sentence_transformers  # noqa: F401
+    with timed("KassalappRAG()"):
+        from rag_engine import KassalappRAG
+        rag = KassalappRAG()
+    record(f"warm-up ready ({SINCE})", time.time() - PROCESS_START)
+    print(f"Warm-up complete: {get_timings()}")
+    return rag
+
+
+def start_warmup():
+    """Starts the background warm-up once per process and returns its future."""
+    global _rag_future
+    with _lock:
+        if _rag_future is None:
+            _rag_future = _executor.submit(_warmup)
+        return _rag_future
+
+
+def get_rag(timeout=None):
+    """Returns the shared RAG engine, waiting for the warm-up to finish if needed."""
+    global _rag_future
+    future = start_warmup()
+    try:
+        return future.result(timeout)
+    except Exception:
+        if future.done():
+            # Let the next call retry instead of caching the failure forever
+            with _lock:
+                if _rag_future is future:
+                    _rag_future = None
+        raise
+
+
+def warmup_status():
+    """Returns "ready", "warming" or "failed"."""
+    future = start_warmup()
+    if not future.done():
+        return "warming"
+    return "failed" if future.exception() else "ready"
+
+
+def profile_imports(modules=PROFILED_MODULES, top=5):
+    """
+    Measures the cold import time of each module in a fresh interpreter.
+
+    Returns a list of {"module", "seconds", "heaviest"} dicts, where "heaviest" lists
+    the slowest direct sub-imports as (name, seconds) pairs.
+    """
+    report = []
+    for module in modules:
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True
+        )
+        if proc.returncode != 0:
+            report.append({"module": module, "seconds": None, "heaviest": [], "error": proc.stderr.strip().splitlines()[-1:]})
+            continue
+
+        # Lines look like "import time:  self | cumulative | <indent>name"; children precede parents
+        children = []
+        entry = {"module": module, "seconds": None, "heaviest": []}
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|", 2)
+            if not cumulative.strip().isdigit():
+                continue  # Header line
+            depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+            seconds = int(cumulative) / 1e6
+            if depth == 1:
+                children.append((name.strip(), seconds))
+            elif depth == 0:
+                if name.strip() == module:
+                    children.sort(key=lambda c: c[1], reverse=True)
+                    entry["seconds"] = seconds
+                    entry["heaviest"] = [(n, round(s, 3)) for n, s in children[:top]]
+                children = []
+        report.append(entry)
+    return report
+
+
+if __name__ == "__main__":
+    modules = sys.argv[1:] or PROFILED_MODULES
+    print(f"Cold import times ({sys.executable} -X importtime):\n")
+    total = 0.0
+    for entry in profile_imports(modules):
+        if entry["seconds"] is None:
+            print(f"{entry['module']:<24} FAILED {' '.join(entry.get('error', []))}")
+            continue
+        total += entry["seconds"]
+        print(f"{entry['module']:<24} {entry['seconds']:>8.3f}s")
+        for name, seconds in entry["heaviest"]:
+            print(f"    {name:<36} {seconds:>8.3f}s")
+    print(f"\nSum of cold imports (shared dependencies counted per module): {total:.3f}s")
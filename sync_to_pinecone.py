@@ -5,14 +5,21 @@ This script handles the one-time or periodic synchronization of local knowledge
 (Markdown/Text) to the Pinecone cloud vector database. It handles document chunking, 
 embedding generation via SentenceTransformers, and memory-efficient batch upserting.
 
+Every sync also rebuilds the local chunk docstore and its embeddings (see docstore.py
+and vector_index.py). With --lean (or PINECONE_LEAN_METADATA=true) the chunk text is
+kept out of Pinecone entirely and the index only stores the chunk ID, source file and
+chunk number.
+
 Usage:
-    python sync_to_pinecone.py
+    python sync_to_pinecone.py [--lean]
 """
 import os
+import sys
 import time
 from dotenv import load_dotenv
 from pinecone import Pinecone, ServerlessSpec
 from sentence_transformers import SentenceTransformer
+from docstore import DocStoreWriter, lean_metadata
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +28,7 @@ load_dotenv()
 PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME", "kassalapp-index")
 KNOWLEDGE_DIR = "knowledge"
+LEAN_METADATA = lean_metadata()
 
 def initialize_pinecone():
     """Initializes Pinecone and ensures the index exists."""
@@ -88,8 +96,12 @@ def chunk_text(text, chunk_size=800):
     return chunks
 
 
-def sync():
-    """Reads the knowledge folder and prepares vectors for Pinecone."""
+def sync(lean=LEAN_METADATA):
+    """Reads the knowledge folder and prepares vectors for Pinecone.
+
+    Args:
+        lean: Store only IDs and filterable fields in Pinecone and keep the text in the local docstore.
+    """
     print(f"Reading folder: {KNOWLEDGE_DIR}...")
     if not os.path.exists(KNOWLEDGE_DIR):
         print(f"Error: Folder '{KNOWLEDGE_DIR}' not found.")
@@ -101,66 +113,77 @@ def sync():
     batch = []
     batch_size = 100
     total_vectors = 0
+    docstore = DocStoreWriter()
     
-    for filename in os.listdir(KNOWLEDGE_DIR):
-        if filename.endswith(".md") or filename.endswith(".txt"):
-            file_path = os.path.join(KNOWLEDGE_DIR, filename)
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
+    try:
+        for filename in os.listdir(KNOWLEDGE_DIR):
+            if filename.endswith(".md") or filename.endswith(".txt"):
+                file_path = os.path.join(KNOWLEDGE_DIR, filename)
+                with open(file_path, "r", encoding="utf-8") as f:
+                    content = f.read()
             
-            chunks = chunk_text(content)
-            print(f"Processing {filename} ({len(chunks)} chunks)...")
+                chunks = chunk_text(content)
+                print(f"Processing {filename} ({len(chunks)} chunks)...")
             
-            for i, chunk in enumerate(chunks):
-                # Generate embedding
-                embedding = model.encode(chunk).tolist()
+                for i, chunk in enumerate(chunks):
+                    # Generate embedding
+                    embedding = model.encode(chunk).tolist()
                 
-                # Prepare the record
-                record = {
-                    "id": f"{filename}_{i}",
-                    "values": embedding,
-                    "metadata": {
-                        "text": chunk,
-                        "source": filename
+                    # Prepare the record
+                    chunk_id = f"{filename}_{i}"
+                    metadata = {"source": filename, "chunk": i}
+                    if not lean:
+                        metadata["text"] = chunk
+                    record = {
+                        "id": chunk_id,
+                        "values": embedding,
+                        "metadata": metadata
                     }
-                }
-                batch.append(record)
-                total_vectors += 1
+                    docstore.add(chunk_id, chunk, filename, embedding)
+                    batch.append(record)
+                    total_vectors += 1
                 
-                # Stream upload if batch is full
-                if len(batch) >= batch_size:
-                    print(f"Uploading batch of {len(batch)} vectors...")
-                    max_retries = 3
-                    for attempt in range(max_retries):
-                        try:
-                            index.upsert(vectors=batch)
-                            break
-                        except Exception as e:
-                            if attempt < max_retries - 1:
-                                wait_time = 2 ** attempt
-                                print(f"Error uploading batch: {e}. Retrying in {wait_time}s...")
-                                time.sleep(wait_time)
-                            else:
-                                print(f"Failed to upload batch after {max_retries} attempts: {e}")
-                                raise
-                    batch = []
-
-    # Final upload for remaining vectors
-    if batch:
-        print(f"Uploading final batch of {len(batch)} vectors...")
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                index.upsert(vectors=batch)
-                break
-            except Exception as e:
-                if attempt < max_retries - 1:
-                    wait_time = 2 ** attempt
-                    print(f"Error uploading final batch: {e}. Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
-                else:
-                    print(f"Failed to upload final batch after {max_retries} attempts: {e}")
-                    raise
+                    # Stream upload if batch is full
+                    if len(batch) >= batch_size:
+                        print(f"Uploading batch of {len(batch)} vectors...")
+                        max_retries = 3
+                        for attempt in range(max_retries):
+                            try:
+                                index.upsert(vectors=batch)
+                                break
+                            except Exception as e:
+                                if attempt < max_retries - 1:
+                                    wait_time = 2 ** attempt
+                                    print(f"Error uploading batch: {e}. Retrying in {wait_time}s...")
+                                    time.sleep(wait_time)
+                                else:
+                                    print(f"Failed to upload batch after {max_retries} attempts: {e}")
+                                    raise
+                        batch = []
+
+        # Final upload for remaining vectors
+        if batch:
+            print(f"Uploading final batch of {len(batch)} vectors...")
+            max_retries = 3
+            for attempt in range(max_retries):
+                try:
+                    index.upsert(vectors=batch)
+                    break
+                except Exception as e:
+                    if attempt < max_retries - 1:
+                        wait_time = 2 ** attempt
+                        print(f"Error uploading final batch: {e}. Retrying in {wait_time}s...")
+                        time.sleep(wait_time)
+                    else:
+                        print(f"Failed to upload final batch after {max_retries} attempts: {e}")
+                        raise
+    except BaseException:
+        docstore.abort()
+        raise
+
+    # Only publish the docstore once every vector made it to Pinecone
+    docstore.close()
+    print(f"Docstore written to '{docstore.path}' ({total_vectors} chunks).")
     
     if total_vectors > 0:
         print(f"Sync Complete! Total vectors processed: {total_vectors}")
@@ -169,6 +192,6 @@ def sync():
 
 if __name__ == "__main__":
     try:
-        sync()
+        sync(lean=LEAN_METADATA or "--lean" in sys.argv[1:])
     except Exception as e:
         print(f"Error: {str(e)}")
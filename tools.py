@@ -1,6 +1,8 @@
 import os
 import requests
 from dotenv import load_dotenv
+from rate_limit import acquire, KASSALAPP_FLIGHT
+from price_history import record_payload
 
 # Load environment variables
 load_dotenv()
@@ -8,14 +10,31 @@ load_dotenv()
 KASSALAPP_API_KEY = os.getenv("KASSALAPP_API_KEY")
 BASE_URL = "https://kassal.app/api/v1"
 
-if not KASSALAPP_API_KEY:
-    raise ValueError("KASSALAPP_API_KEY not found in environment variables")
+# Seconds to connect / to wait for a response. Coalesced callers share the leader's
+# request, so a hung request must fail rather than block all of them.
+REQUEST_TIMEOUT = (5, 15)
 
 HEADERS = {
     "Authorization": f"Bearer {KASSALAPP_API_KEY}",
     "Accept": "application/json"
 }
 
+def _get(url, params=None):
+    """GET a Kassalapp endpoint through the shared rate limiter, coalescing identical in-flight calls."""
+    # Checked per call rather than at import so the app can start without the key
+    if not KASSALAPP_API_KEY:
+        return {"error": "Missing API key", "message": "KASSALAPP_API_KEY not found in environment variables"}
+
+    key = (url, tuple(sorted((params or {}).items())))
+
+    def fetch():
+        acquire("kassalapp")
+        response = requests.get(url, headers=HEADERS, params=params, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    return KASSALAPP_FLIGHT.do(key, fetch)
+
 def search_products(search: str = None, size: int = 10, sort: str = "price_asc", store: str = None, **kwargs):
     """
     Search for products based on a keyword.
@@ -23,7 +42,7 @@ def search_products(search: str = None, size: int = 10, sort: str = "price_asc",
     Args:
         search: Search for products based on a keyword (minimum 3 characters).
         size: The number of products to be displayed per page (1-100).
-        sort: Sort criteria: price_asc, price_desc, name_asc, name_desc, etc.
+        sort: Sort criteria: price_asc, price_desc, name_asc, name_desc, etc. (None for relevance).
         store: Filter products by store (e.g., SPAR_NO, MENY_NO, KIWI).
     """
     # Defensive handling for common LLM parameter hallucinations
@@ -34,16 +53,16 @@ def search_products(search: str = None, size: int = 10, sort: str = "price_asc",
     url = f"{BASE_URL}/products"
     params = {
         "search": query,
-        "size": size,
-        "sort": sort
+        "size": size
     }
+    # sort=None keeps the API's relevance order
+    if sort:
+        params["sort"] = sort
     if store:
         params["store"] = store
         
     try:
-        response = requests.get(url, headers=HEADERS, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = _get(url, params)
         
         # Optimization: Filter response to save tokens
         if "data" in data:
@@ -56,6 +75,7 @@ def search_products(search: str = None, size: int = 10, sort: str = "price_asc",
                     "store": p.get("store", {}).get("name") if p.get("store") else None,
                     "ean": p.get("ean")
                 })
+            record_payload(data)
             return {"data": optimized_data}
         return data
     except requests.exceptions.RequestException as e:
@@ -65,9 +85,9 @@ def get_product_by_id(product: int):
     """Lookup product by ID."""
     url = f"{BASE_URL}/products/id/{product}"
     try:
-        response = requests.get(url, headers=HEADERS)
-        response.raise_for_status()
-        return response.json()
+        data = _get(url)
+        record_payload(data)
+        return data
     except requests.exceptions.RequestException as e:
         return {"error": str(e), "message": f"Failed to fetch product {product}"}
         
@@ -75,9 +95,9 @@ def get_product_by_ean(ean: str):
     """Lookup product by EAN barcode."""
     url = f"{BASE_URL}/products/ean/{ean}"
     try:
-        response = requests.get(url, headers=HEADERS)
-        response.raise_for_status()
-        return response.json()
+        data = _get(url)
+        record_payload(data)
+        return data
     except requests.exceptions.RequestException as e:
         return {"error": str(e), "message": f"Failed to fetch product EAN {ean}"}
 
@@ -105,9 +125,7 @@ def search_physical_stores(search: str = None, group: str = None, lat: float = N
     if size: params["size"] = size
     
     try:
-        response = requests.get(url, headers=HEADERS, params=params)
-        response.raise_for_status()
-        data = response.json()
+        data = _get(url, params)
         
         # Optimization: Filter response to save tokens
         if "data" in data:
@@ -128,9 +146,7 @@ def find_physical_store_by_id(physicalStore: int):
     """Find physical store by ID."""
     url = f"{BASE_URL}/physical-stores/{physicalStore}"
     try:
-        response = requests.get(url, headers=HEADERS)
-        response.raise_for_status()
-        return response.json()
+        return _get(url)
     except requests.exceptions.RequestException as e:
         return {"error": str(e), "message": f"Failed to fetch store {physicalStore}"}
 
@@ -139,9 +155,7 @@ def compare_product_prices_by_url(url: str):
     endpoint = f"{BASE_URL}/products/find-by-url/compare"
     params = {"url": url}
     try:
-        response = requests.get(endpoint, headers=HEADERS, params=params)
-        response.raise_for_status()
-        return response.json()
+        return _get(endpoint, params)
     except requests.exceptions.RequestException as e:
         return {"error": str(e), "message": "Failed to compare prices"}
 
@@ -0,0 +1,168 @@
+"""
+Local Vector Index for Kassalapp Assistant.
+
+Searches the chunk embeddings written by sync_to_pinecone.py (docstore/embeddings.npy)
+without a round trip to Pinecone. The resident index can be stored in three modes:
+
+    float32  Exact search over the full-precision vectors (1x)
+    float16  Half-precision copy, 2x smaller
+    binary   1 bit per dimension (sign), 32x smaller, searched by Hamming distance
+
+The compressed modes over-fetch candidates and rescore them against the full-precision
+vectors, which stay in a memory-mapped file and are only paged in for the candidates.
+NumPy has no fast half-precision matmul, so float16 trades speed for memory; binary is
+both the smallest and the fastest for single queries. See benchmark_index.py for
+recall@k and queries/sec against exact search.
+"""
+import os
+import numpy as np
+from docstore import DOCSTORE_DIR, EMBEDDINGS_FILE, DocStore
+
+MODES = ("float32", "float16", "binary")
+
+# Candidates fetched per result before rescoring, per mode
+DEFAULT_OVERSAMPLE = {"float32": 1, "float16": 2, "binary": 32}
+
+# Temporary memory a search may use per block of rows
+BLOCK_BYTES = 16 * 1024 * 1024
+
+# Number of set bits for every byte value (fallback for NumPy < 2.0)
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def normalize(vectors):
+    """L2-normalizes row vectors so a dot product is the cosine similarity."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _pack_bits(vectors):
+    """Packs the sign of every dimension into bits, as 64-bit words when the width allows it."""
+    packed = np.packbits(np.asarray(vectors) > 0, axis=1)
+    return packed.view(np.uint64) if packed.shape[1] % 8 == 0 else packed
+
+
+def _hamming(query_bits, codes):
+    """Hamming distance between every query and every code (Q x N)."""
+    xor = np.bitwise_xor(query_bits[:, None, :], codes[None, :, :])
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor).sum(axis=2, dtype=np.int32)
+    return _POPCOUNT[xor.view(np.uint8)].sum(axis=2, dtype=np.int32)
+
+
+def _top_k(scores, k):
+    """Indices of the k highest scores per row, best first."""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+
+class LocalVectorIndex:
+    """In-memory (optionally quantized) vector index with full-precision rescoring."""
+
+    def __init__(self, vectors, ids=None, mode="float32"):
+        """
+        Args:
+            vectors: Full-precision, L2-normalized vectors (N x dim). May be a memory map.
+            ids: Optional labels for the rows (defaults to row numbers).
+            mode: Resident storage mode, one of MODES.
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown index mode '{mode}'. Use one of {MODES}.")
+        self.mode = mode
+        self.vectors = vectors
+        self.ids = list(ids) if ids is not None else list(range(len(vectors)))
+
+        if mode == "float16":
+            self.codes = np.asarray(vectors, dtype=np.float16)
+        elif mode == "binary":
+            self.codes = _pack_bits(vectors)
+        else:
+            self.codes = vectors
+
+    @classmethod
+    def from_docstore(cls, path=DOCSTORE_DIR, mode="float32"):
+        """Loads the embeddings written by sync_to_pinecone.py, memory-mapping the full vectors."""
+        vectors = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        docstore = DocStore(path)
+        ids = docstore.ids()
+        docstore.close()
+        if len(ids) != len(vectors):
+            raise ValueError(f"Docstore '{path}' has {len(ids)} chunks but {len(vectors)} embeddings. Re-run the sync.")
+        return cls(vectors, ids, mode)
+
+    @staticmethod
+    def exists(path=DOCSTORE_DIR):
+        return os.path.exists(os.path.join(path, EMBEDDINGS_FILE)) and DocStore.exists(path)
+
+    @property
+    def resident_bytes(self):
+        """Memory held by the searched codes (the memory-mapped vectors are not counted)."""
+        return 0 if self.mode == "float32" and isinstance(self.codes, np.memmap) else self.codes.nbytes
+
+    def _block_scores(self, queries, query_bits, block):
+        """Approximate similarity of every query to one block of codes (higher is better)."""
+        if self.mode == "binary":
+            return -_hamming(query_bits, block).astype(np.float32)
+        return queries @ np.asarray(block, dtype=np.float32).T
+
+    def search(self, queries, k=3, oversample=None, rows=None):
+        """
+        Finds the k nearest rows for each query.
+
+        Args:
+            queries: One vector or a (Q x dim) matrix of query vectors.
+            k: Results per query.
+            oversample: Candidates per result kept for rescoring (defaults per mode).
+            rows: Optional row indices to restrict the search to (e.g. one source file).
+
+        Returns:
+            (indices, scores) arrays of shape (Q x k), best first, with cosine scores.
+        """
+        queries = normalize(np.atleast_2d(queries))
+        n_rows = len(self.ids) if rows is None else len(rows)
+        if n_rows == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+
+        oversample = DEFAULT_OVERSAMPLE[self.mode] if oversample is None else oversample
+        n_candidates = min(n_rows, k * max(1, oversample))
+        query_bits = _pack_bits(queries) if self.mode == "binary" else None
+
+        # 1. Approximate search over the compressed codes, block by block
+        row_bytes = self.codes[:1].nbytes * len(queries) if self.mode == "binary" else self.codes.shape[1] * 4
+        block_size = max(1024, BLOCK_BYTES // row_bytes)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, n_rows, block_size):
+            if rows is None:
+                # Contiguous slices avoid copying the (memory-mapped) codes
+                block_rows = np.arange(start, min(start + block_size, n_rows))
+                block = self.codes[start:start + block_size]
+            else:
+                block_rows = np.asarray(rows[start:start + block_size])
+                block = self.codes[block_rows]
+            scores = np.concatenate([best_scores, self._block_scores(queries, query_bits, block)], axis=1)
+            candidates = np.concatenate([best_rows, np.broadcast_to(block_rows, (len(queries), len(block_rows)))], axis=1)
+            keep = _top_k(scores, n_candidates)
+            best_rows = np.take_along_axis(candidates, keep, axis=1)
+            best_scores = np.take_along_axis(scores, keep, axis=1)
+
+        if self.mode == "float32":
+            return best_rows[:, :k], best_scores[:, :k]
+
+        # 2. Rescore the candidates against the full-precision (memory-mapped) vectors
+        unique_rows, inverse = np.unique(best_rows, return_inverse=True)
+        full = np.asarray(self.vectors[unique_rows], dtype=np.float32)
+        exact = np.einsum("qd,qcd->qc", queries, full[inverse.reshape(best_rows.shape)])
+        keep = _top_k(exact, k)
+        return np.take_along_axis(best_rows, keep, axis=1), np.take_along_axis(exact, keep, axis=1)
+
+    def query(self, queries, k=3, oversample=None, rows=None):
+        """Like search(), but returns Pinecone-shaped results: [{"matches": [{"id", "score"}]}] per query."""
+        indices, scores = self.search(queries, k, oversample, rows)
+        return [
+            {"matches": [{"id": self.ids[i], "score": float(s)} for i, s in zip(row_indices, row_scores)]}
+            for row_indices, row_scores in zip(indices, scores)
+        ]